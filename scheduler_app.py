@@ -1,14 +1,27 @@
 # filename: scheduler_app.py
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
+import bisect
+import copy
+import heapq
+import itertools
 import json
+import math
 import os
+import queue
+import re
+import secrets
+import shutil
 import subprocess
 import sys
 from pathlib import Path
 import time
 import threading
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType, SimpleNamespace
+from urllib.parse import parse_qs, urlparse
 # ---- Safe tkdnd detection ----
 HAS_DND = False
 try:
@@ -28,10 +41,6 @@ except Exception:
 # ------------------------------
 import obsws_python as obs  # v5 client
 
-def seconds_since_midnight() -> int:
-    now = datetime.now()
-    return now.hour * 3600 + now.minute * 60 + now.second
-
 def get_media_duration(file_path):
     """Get duration of media file using ffprobe."""
     try:
@@ -44,34 +53,926 @@ def get_media_duration(file_path):
     except Exception:
         return 0.0  # Default to 0 if error
 
+FILLER_TAIL_SMALL_SET = 4   # with this few fillers the tail may repeat one
+FILLER_TAIL_REPEATS = 8     # most copies of one filler in the tail
+FILLER_TAIL_GRID = 1000     # ms per subset-sum bucket
+FILLER_TAIL_MAX_STATES = 5000
+FILLER_TAIL_WINDOW = 600000  # ms left for the tail search at most
+
+def plan_filler_sequence(gap, durations, last_played=None):
+    """Pack fillers into `gap` seconds, least recently played first, with a best-fit tail; returns (paths, total_seconds)."""
+    last_played = last_played or {}
+    items = [(p, int(math.ceil(d * 1000))) for p, d in durations.items() if d and d > 0]
+    if gap <= 0 or not items:
+        return [], 0
+    # Least recently played first; never-played fillers keep their list order
+    items.sort(key=lambda x: last_played.get(x[0], -1))
+    rotation = list(items)
+    reps = FILLER_TAIL_REPEATS if len(items) <= FILLER_TAIL_SMALL_SET else 1
+    # Small sets pack the tail from up to two rounds of copies, larger sets from about
+    # half the fillers; either way the window stays small enough for the grid search
+    total_ms = sum(d for _, d in items)
+    longest = max(d for _, d in items)
+    tail_window = max(min(total_ms * 2 if reps > 1 else total_ms // 2, FILLER_TAIL_WINDOW), 2 * longest)
+    seq = []
+    gap_ms = int(gap * 1000)
+    remaining = gap_ms
+    while remaining > tail_window:
+        pick = next((k for k, (_, d) in enumerate(rotation) if d <= remaining), None)
+        if pick is None:
+            break
+        p, d = rotation.pop(pick)
+        rotation.append((p, d))
+        seq.append(p)
+        remaining -= d
+    # Best fit for the tail: bucket -> (true ms total, previous bucket, filler).
+    # First claim goes to the fairest filler; copies are offered round by round,
+    # so a repeat only wins when it fits better.
+    best = {0: (0, None, None)}
+    for _ in range(reps):
+        for p, d in rotation:
+            for total, _prev, _p in list(best.values()):
+                nt = total + d
+                key = nt // FILLER_TAIL_GRID
+                if nt <= remaining and key not in best and len(best) < FILLER_TAIL_MAX_STATES:
+                    best[key] = (nt, total // FILLER_TAIL_GRID, p)
+    key = max(best, key=lambda k: best[k][0])
+    fit = best[key][0]
+    tail = []
+    while best[key][2] is not None:
+        _, key, p = best[key]
+        tail.append(p)
+    seq.extend(reversed(tail))
+    return seq, (gap_ms - remaining + fit) / 1000
+
+def scheduled_duration(v) -> int:
+    """Seconds an item occupies on the schedule; a trim shortens it without touching the media duration."""
+    if v.get('trim_to') is not None:
+        return int(v['trim_to'])
+    if 'block' in v:
+        return v['block'].duration
+    return int(v['duration'])
+
+class Block:
+    """A shared, read-only run of media items that any number of playlist rows reference."""
+    __slots__ = ("name", "items", "offsets", "duration")
+
+    def __init__(self, name, items):
+        self.name = name
+        self.set_items(items)
+
+    def set_items(self, items):
+        flat = []
+        for v in items:
+            if 'block' in v:
+                flat.extend(v['block'].items)
+            else:
+                d = dict(v)
+                d['absolute_time'] = None
+                d.pop('repeat', None)
+                flat.append(MappingProxyType(d))
+        self.items = tuple(flat)
+        self.offsets = []
+        total = 0
+        for v in self.items:
+            self.offsets.append(total)
+            total += scheduled_duration(v)
+        self.duration = total
+
+def row_title(v) -> str:
+    if 'block' in v:
+        return f"▣ {v['block'].name} ({len(v['block'].items)} items)"
+    return v['filename']
+
+def parse_recurrence(text):
+    """Parse 'HH:MM:SS daily' or 'HH:MM:SS every HH:MM:SS xN' into (start, every, count)."""
+    def hms(t):
+        h, m, s = map(int, t.split(':'))
+        return h * 3600 + m * 60 + s
+    parts = text.lower().split()
+    start = hms(parts[0])
+    if not 0 <= start < 86400:
+        raise ValueError(text)
+    if parts[1:] == ["daily"]:
+        return start, 86400, 1
+    if len(parts) in (3, 4) and parts[1] == "every":
+        every = hms(parts[2])
+        count = int(parts[3].lstrip('x×')) if len(parts) == 4 else (86400 - start - 1) // max(every, 1) + 1
+        if every <= 0 or count <= 0:
+            raise ValueError(text)
+        return start, every, count
+    raise ValueError(text)
+
+def parse_hms(text):
+    """Strict 'HH:MM:SS' within one day to seconds; raises ValueError otherwise."""
+    m = re.fullmatch(r"(\d{1,2}):(\d{2}):(\d{2})", text.strip()) if isinstance(text, str) else None
+    if not m:
+        raise ValueError(f"time must be HH:MM:SS, got {text!r}")
+    h, mi, se = map(int, m.groups())
+    if h > 23 or mi > 59 or se > 59:
+        raise ValueError(f"time out of range: {text!r}")
+    return h * 3600 + mi * 60 + se
+
+def occurrence_span(start, dur, rep, t):
+    """(start, end) of the occurrence of a row covering t, or None. Recurrences are never expanded."""
+    if rep:
+        every, count = rep
+        k = (t - start) // every if t >= start else 0
+        k = min(k, count - 1)
+        start += k * every
+        if start >= 86400 and k:
+            return None
+    return (start, start + dur) if start <= t < start + dur else None
+
+def next_occurrence_start(start, rep, t):
+    """Start of the first occurrence of a row after t, or None."""
+    if not rep:
+        return start if start > t else None
+    every, count = rep
+    k = 0 if t < start else (t - start) // every + 1
+    s = start + k * every
+    return s if k < count and (s < 86400 or k == 0) else None
+
+class CompiledSchedule:
+    """Immutable schedule snapshot for the playout thread; rows are (start, duration, repeat, media)."""
+    __slots__ = ("rows", "order", "starts", "reach", "repeating")
+
+    def __init__(self, videos=(), starts=()):
+        rows = []
+        for v, s in zip(videos, starts):
+            if 'block' in v:
+                blk = v['block']
+                media = tuple((off, m['filepath'], m['filename']) for off, m in zip(blk.offsets, blk.items))
+            else:
+                media = ((0, v['filepath'], v['filename']),)
+            rep = tuple(v['repeat']) if v.get('repeat') else None
+            rows.append((s, scheduled_duration(v), rep, media))
+        self.rows = tuple(rows)
+        # One-off rows sorted by start, with the furthest end reached so far; repeating rows are few and scanned
+        self.order = sorted((r[0], i) for i, r in enumerate(rows) if not r[2])
+        self.starts = [s for s, _ in self.order]
+        self.reach = list(itertools.accumulate((s + rows[i][1] for s, i in self.order), max))
+        self.repeating = tuple(i for i, r in enumerate(rows) if r[2])
+
+    def occurrence_at(self, t):
+        """(row, start, end) of the occurrence on air at t, or None; the lowest row wins on overlap."""
+        best = None
+        k = bisect.bisect_right(self.starts, t) - 1
+        # Walk back only while some earlier row still reaches past t
+        while k >= 0 and self.reach[k] > t:
+            s, i = self.order[k]
+            if s + self.rows[i][1] > t and (best is None or i < best[0]):
+                best = (i, s, s + self.rows[i][1])
+            k -= 1
+        for i in self.repeating:
+            if best is not None and i > best[0]:
+                break
+            s, dur, rep, _ = self.rows[i]
+            occ = occurrence_span(s, dur, rep, t)
+            if occ:
+                return i, occ[0], occ[1]
+        return best
+
+    def media_at(self, i, offset):
+        """((offset, filepath, filename), offset into that media) `offset` seconds into row i."""
+        media = self.rows[i][3]
+        k = 0
+        if len(media) > 1:
+            k = max(bisect.bisect_right(media, offset, key=lambda m: m[0]) - 1, 0)
+        return media[k], offset - media[k][0]
+
+    def next_occurrence(self, t):
+        """(row, start) of the next occurrence starting after t, or (None, None)."""
+        k = bisect.bisect_right(self.starts, t)
+        start, idx = self.order[k] if k < len(self.order) else (None, None)
+        for i in self.repeating:
+            s, _, rep, _ = self.rows[i]
+            s = next_occurrence_start(s, rep, t)
+            if s is not None and (start is None or (s, i) < (start, idx)):
+                start, idx = s, i
+        return idx, start
+
+    def next_change(self, t):
+        """Earliest second after t at which what should be on air can change, or None."""
+        nxt = self.next_occurrence(t)[1]
+        occ = self.occurrence_at(t)
+        if occ is None:
+            return nxt
+        i, s, e = occ
+        media = self.rows[i][3]
+        k = bisect.bisect_right(media, t - s, key=lambda m: m[0])
+        change = s + media[k][0] if k < len(media) else e
+        return min(change, nxt) if nxt is not None else change
+
+def schedule_occurrences(starts, ends, repeats=None):
+    """Yield (start, end, row) for every occurrence in start order; a repeating row wins ties."""
+    if not repeats or not any(repeats):
+        yield from ((s, e, i) for s, e, i in sorted(zip(starts, ends, range(len(starts)))))
+        return
+    heap = [(s, not rep, e, i, 0) for i, (s, e, rep) in enumerate(zip(starts, ends, repeats))]
+    heapq.heapify(heap)
+    while heap:
+        s, _, e, i, k = heap[0]
+        yield s, e, i
+        rep = repeats[i]
+        if rep and k + 1 < rep[1] and s + rep[0] < 86400:
+            heapq.heapreplace(heap, (s + rep[0], False, e + rep[0], i, k + 1))
+        else:
+            heapq.heappop(heap)
+
+def analyze_schedule(starts, ends, repeats=None):
+    """Report 'overlaps' (earlier, later, seconds), 'gaps' (start, end, next) and 'past_midnight' rows."""
+    report = {"overlaps": [], "gaps": [], "past_midnight": []}
+    owner = None  # item reaching furthest so far
+    reach = None
+    for s, e, i in schedule_occurrences(starts, ends, repeats):
+        if e > 86400 and i not in report["past_midnight"][-1:]:
+            report["past_midnight"].append(i)
+        if owner is not None:
+            if s < reach:
+                report["overlaps"].append((owner, i, min(reach, e) - s))
+            elif s > reach:
+                report["gaps"].append((reach, s, i))
+        if reach is None or e > reach:
+            owner, reach = i, e
+    return report
+
+def resolve_overlaps(videos, starts, ends, policy):
+    """Edit operations that push, trim or drop one-off items to resolve overlaps; repeating rows are left alone."""
+    repeats = [v.get('repeat') for v in videos]
+    ops = []
+    dropped = set()
+    owner = None
+    owner_start = reach = None
+    for s, e, i in schedule_occurrences(starts, ends, repeats):
+        if i in dropped:
+            continue
+        if owner is not None and s < reach and repeats[i]:
+            if e > reach:
+                owner, owner_start, reach = i, s, e
+            continue
+        if owner is not None and s < reach:
+            cut = s - owner_start
+            if policy == "drop" and videos[i].get('absolute_time') is not None:
+                dropped.add(i)
+                continue
+            if policy == "trim" and cut > 0 and not repeats[owner]:
+                ops.append(("set", owner, 'trim_to', cut))
+                owner, owner_start, reach = i, s, e
+                continue
+            if videos[i].get('absolute_time') is not None:
+                # push, or a trim that would leave nothing of the earlier item
+                ops.append(("set", i, 'absolute_time', reach))
+                s, e = reach, reach + scheduled_duration(videos[i])
+        if reach is None or e > reach:
+            owner, owner_start, reach = i, s, e
+    for i in sorted(dropped, reverse=True):
+        ops.append(("splice", i, 1, []))
+    return ops
+
+UNSET = object()
+
+def apply_edit_op(videos, op):
+    """Apply one splice/swap/set/items edit and return the operation that undoes it."""
+    kind = op[0]
+    if kind == "splice":
+        _, i, n, rows = op
+        removed = videos[i:i + n]
+        videos[i:i + n] = rows
+        return ("splice", i, len(rows), removed)
+    if kind == "swap":
+        _, i, j = op
+        videos[i], videos[j] = videos[j], videos[i]
+        return op
+    if kind == "set":
+        _, i, key, value = op
+        row = videos[i]
+        old = row.get(key, UNSET)
+        if value is UNSET:
+            row.pop(key, None)
+        else:
+            row[key] = value
+        return ("set", i, key, old)
+    if kind == "items":
+        _, blk, items = op
+        old = blk.items
+        blk.set_items(items)
+        return ("items", blk, old)
+    raise ValueError(f"Unknown edit operation {kind!r}")
+
+class EditHistory:
+    """Undo/redo stacks of edit groups, each stored as the inverse operations of one user action."""
+
+    def __init__(self, limit=500, on_apply=None):
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = []
+        self.on_apply = on_apply      # called once per applied group (list of ops), including undo/redo
+
+    def _run(self, videos, ops):
+        inverse = []
+        try:
+            for op in ops:
+                inverse.append(apply_edit_op(videos, op))
+        finally:
+            if self.on_apply and inverse:
+                self.on_apply(ops[:len(inverse)])
+        inverse.reverse()
+        return inverse
+
+    def apply(self, videos, ops, label):
+        inverse = self._run(videos, ops)
+        if inverse:
+            self.undo_stack.append((label, inverse))
+            self.redo_stack.clear()
+        return len(inverse)
+
+    def undo(self, videos):
+        if not self.undo_stack:
+            return None
+        label, ops = self.undo_stack.pop()
+        self.redo_stack.append((label, self._run(videos, ops)))
+        return label
+
+    def redo(self, videos):
+        if not self.redo_stack:
+            return None
+        label, ops = self.redo_stack.pop()
+        self.undo_stack.append((label, self._run(videos, ops)))
+        return label
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+class LockedClient:
+    """Wraps an obsws ReqClient so each request/response pair is atomic across threads."""
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+class SystemClock:
+    """Wall clock used on air. Playout reads time and waits for commands through its clock."""
+    def now(self):
+        return datetime.now()
+
+    def seconds_since_midnight(self):
+        now = self.now()
+        return now.hour * 3600 + now.minute * 60 + now.second
+
+    def time_of_day(self):
+        """Seconds since midnight with sub-second resolution."""
+        now = self.now()
+        return now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def wait(self, commands, timeout, until=None):
+        """Next command from the queue; raises queue.Empty after timeout. `until` is a hint for simulated clocks."""
+        return commands.get(timeout=timeout)
+
+class SimulatedClock(SystemClock):
+    """Replay clock, `speed` times real time (0 = unpaced), that jumps straight to the next change."""
+    def __init__(self, start, end, speed=600, on_end=None):
+        self.start = self.t = start.replace(microsecond=0)
+        self.end = end
+        self.speed = speed
+        self.on_end = on_end
+        self.stopped = threading.Event()
+
+    def now(self):
+        return self.t
+
+    def monotonic(self):
+        return (self.t - self.start).total_seconds()
+
+    def stop(self):
+        self.stopped.set()
+
+    def wait(self, commands, timeout, until=None):
+        try:
+            return commands.get_nowait()
+        except queue.Empty:
+            pass
+        if not timeout:
+            raise queue.Empty
+        midnight = self.t.replace(hour=0, minute=0, second=0)
+        sod = self.seconds_since_midnight()
+        target = midnight + timedelta(seconds=until if until is not None and until > sod else 86400)
+        target = min(target, self.end)
+        if self.speed and self.stopped.wait((target - self.t).total_seconds() / self.speed):
+            target = self.end
+        if self.stopped.is_set():
+            target = self.end
+        self.t = target
+        if self.t >= self.end and self.on_end:
+            self.on_end()
+        raise queue.Empty
+
+class RecordingOBS:
+    """Stand-in OBS client for replay that records what reaches program."""
+    def __init__(self, clock, durations):
+        self.clock = clock
+        self.durations = durations  # normalized filepath -> seconds
+        self.inputs = {}            # name -> [kind, settings]
+        self.scenes = {}            # name -> [input names]
+        self.program = None
+        self.airings = []           # (at, input, files, offset, loop)
+        self.requests = 0
+
+    def __getattr__(self, name):
+        # Requests the replay does not model succeed without data
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def request(*args, **kwargs):
+            self.requests += 1
+            return SimpleNamespace(responseData={})
+        return request
+
+    def reply(self, data=None):
+        self.requests += 1
+        return SimpleNamespace(responseData=data or {})
+
+    def air(self, name, offset=0):
+        kind, settings = self.inputs[name]
+        if "playlist" in settings:
+            files = tuple(p["value"] for p in settings["playlist"])
+            loop = settings.get("loop", False)
+        else:
+            files = (settings.get("local_file", ""),)
+            loop = settings.get("looping", False)
+        self.airings.append((self.clock.now(), name, files, offset, loop))
+
+    def on_program(self, name):
+        return name in self.scenes.get(self.program, ())
+
+    def create_scene(self, scene):
+        if scene in self.scenes:
+            raise ValueError(f"scene {scene} exists")
+        self.scenes[scene] = []
+        return self.reply()
+
+    def create_input(self, scene, name, kind, settings, enabled):
+        self.inputs[name] = [kind, dict(settings)]
+        self.scenes.setdefault(scene, []).append(name)
+        return self.reply()
+
+    def remove_input(self, name):
+        if self.inputs.pop(name, None) is None:
+            raise KeyError(name)
+        for items in self.scenes.values():
+            if name in items:
+                items.remove(name)
+        return self.reply()
+
+    def create_scene_item(self, scene, name):
+        self.scenes.setdefault(scene, []).append(name)
+        return self.reply()
+
+    def get_input_settings(self, name):
+        if name not in self.inputs:
+            raise KeyError(name)
+        return self.reply({"inputSettings": dict(self.inputs[name][1])})
+
+    def set_input_settings(self, name, settings, overlay):
+        if name not in self.inputs:
+            raise KeyError(name)
+        if overlay:
+            self.inputs[name][1].update(settings)
+        else:
+            self.inputs[name][1] = dict(settings)
+        return self.reply()
+
+    def get_input_list(self):
+        return self.reply({"inputs": [{"inputName": n, "inputKind": k} for n, (k, _) in self.inputs.items()]})
+
+    def get_scene_item_list(self, scene):
+        return self.reply({"sceneItems": [{"sourceName": n} for n in self.scenes.get(scene, ())]})
+
+    def set_current_program_scene(self, scene):
+        if scene != self.program:
+            self.program = scene
+            # Both app sources restart on activation
+            for name in self.scenes.get(scene, ()):
+                self.air(name)
+        return self.reply()
+
+    def trigger_media_input_action(self, name, action):
+        if action.endswith("_RESTART") and self.on_program(name):
+            self.air(name)
+        return self.reply()
+
+    def set_media_input_cursor(self, name, cursor_ms):
+        if self.on_program(name):
+            self.air(name, cursor_ms / 1000)
+        return self.reply()
+
+    def get_media_input_status(self, name):
+        last = next((a for a in reversed(self.airings) if a[1] == name), None)
+        if not last:
+            return self.reply({"mediaState": "OBS_MEDIA_STATE_NONE"})
+        at, _, files, offset, _ = last
+        dur = self.durations.get(files[0], 0)
+        cur = offset + (self.clock.now() - at).total_seconds()
+        state = "OBS_MEDIA_STATE_PLAYING" if cur < dur else "OBS_MEDIA_STATE_ENDED"
+        return self.reply({"mediaState": state, "mediaCursor": int(min(cur, dur) * 1000), "mediaDuration": int(dur * 1000)})
+
+    def timeline(self, start, end):
+        """Segments (start, end, input, file) covering start..end; input and file are None for dead air."""
+        segments = []
+        marks = [a for a in self.airings if a[0] < end] + [(end, None, (), 0, False)]
+        t = start
+        for (at, name, files, offset, loop), nxt in zip(marks, marks[1:]):
+            if at > t:
+                segments.append((t, at, None, None))
+            t, skip, i, lap = at, offset, 0, at
+            stop = nxt[0]
+            while t < stop and files:
+                f = files[i % len(files)]
+                dur = self.durations.get(f)
+                if dur is None:
+                    # Unknown length: assume it runs until the next switch
+                    segments.append((t, stop, name, f))
+                    t = stop
+                    break
+                if skip < dur:
+                    seg_end = min(stop, t + timedelta(seconds=dur - skip))
+                    segments.append((t, seg_end, name, f))
+                    t = seg_end
+                skip = max(skip - dur, 0)
+                i += 1
+                if i % len(files) == 0:
+                    if not loop or t == lap:
+                        break
+                    lap = t
+            if t < stop:
+                segments.append((t, stop, None, None))
+            t = max(t, stop)
+        if t < end:
+            segments.append((t, end, None, None))
+        return [s for s in segments if s[1] > s[0]]
+
+def state_dir():
+    base = os.environ.get("APPDATA") or os.path.join(str(Path.home()), ".config")
+    return os.path.join(base, "OBS Playlist Scheduler")
+
+def api_token():
+    """Bearer token for the control API, created once per machine and kept next to the journal."""
+    path = os.path.join(state_dir(), "api_token")
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    os.makedirs(state_dir(), exist_ok=True)
+    token = secrets.token_urlsafe(24)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
+
+class StateJournal:
+    """Append-only, fsynced, sequence-numbered journal compacted into an atomically replaced snapshot."""
+    SNAPSHOT_EVERY = 500
+
+    def __init__(self, folder):
+        self.snapshot_path = os.path.join(folder, "snapshot.json")
+        self.journal_path = os.path.join(folder, "journal.jsonl")
+        self.seq = 0
+        self.pending = 0
+        self.fh = None
+        try:
+            os.makedirs(folder, exist_ok=True)
+            self.fh = open(self.journal_path, "a", encoding="utf-8")
+        except Exception as e:
+            print(f"Journal disabled: {e}")
+
+    def load(self):
+        snapshot = None
+        records = []
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Snapshot unreadable: {e}")
+        done = snapshot.get("seq", 0) if snapshot else 0
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break
+                    if rec.get("seq", 0) > done:
+                        records.append(rec)
+        except FileNotFoundError:
+            pass
+        self.seq = max([done] + [r.get("seq", 0) for r in records])
+        self.pending = len(records)
+        return snapshot, records
+
+    def append(self, record):
+        if not self.fh:
+            return
+        try:
+            self.seq += 1
+            record["seq"] = self.seq
+            self.fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self.pending += 1
+        except Exception as e:
+            print(f"Journal write error: {e}")
+
+    def due(self):
+        return self.pending >= self.SNAPSHOT_EVERY
+
+    def preserve(self):
+        """Copy the snapshot and journal aside, e.g. before compacting after a failed replay; returns the journal copy."""
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        backup = f"{self.journal_path}.failed-{stamp}"
+        try:
+            if self.fh:
+                self.fh.flush()
+            shutil.copy2(self.journal_path, backup)
+            if os.path.exists(self.snapshot_path):
+                shutil.copy2(self.snapshot_path, f"{self.snapshot_path}.failed-{stamp}")
+        except Exception as e:
+            print(f"Journal backup error: {e}")
+        return backup
+
+    def compact(self, snapshot):
+        if not self.fh:
+            return
+        try:
+            snapshot["seq"] = self.seq
+            tmp = self.snapshot_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            self.fh.close()
+            self.fh = open(self.journal_path, "w", encoding="utf-8")
+            self.pending = 0
+        except Exception as e:
+            print(f"Snapshot write error: {e}")
+
+class CommandConflict(Exception):
+    """An API command that is well-formed but cannot run in the app's current state."""
+
+class ControlAPIHandler(BaseHTTPRequestHandler):
+    """Routes for the local control API; `api` is bound per server by ControlAPI."""
+    protocol_version = "HTTP/1.1"
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, payload):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def allowed(self):
+        """Reject DNS-rebinding hosts, foreign origins and requests without the token; sends the error itself."""
+        local = {f"{h}:{self.api.port}" for h in ("127.0.0.1", "localhost")}
+        if self.headers.get("Host", "") not in local:
+            self.send_json(403, {"error": "bad host"})
+            return False
+        origin = self.headers.get("Origin")
+        if origin is not None and origin not in {f"http://{h}" for h in local}:
+            self.send_json(403, {"error": "cross-origin requests are not allowed"})
+            return False
+        auth = self.headers.get("Authorization", "")
+        # EventSource cannot set headers, so reads may pass the token as ?token=
+        query = parse_qs(urlparse(self.path).query).get("token", [""])[0] if self.command == "GET" else ""
+        given = auth[7:] if auth.startswith("Bearer ") else query
+        if not secrets.compare_digest(given.encode("utf-8"), self.api.token.encode("utf-8")):
+            self.send_json(401, {"error": "missing or wrong token"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.allowed():
+            return
+        path = urlparse(self.path).path.rstrip("/")
+        if path in ("/status", "/now"):
+            self.send_json(200, self.api.status_json())
+        elif path == "/schedule":
+            self.send_json(200, self.api.schedule_json())
+        elif path == "/events":
+            self.stream_events()
+        else:
+            self.send_json(404, {"error": f"unknown endpoint {path}"})
+
+    def do_POST(self):
+        if not self.allowed():
+            return
+        path = urlparse(self.path).path.rstrip("/")
+        name = path.lstrip("/")
+        try:
+            n = int(self.headers.get("Content-Length") or 0)
+            if n < 0:
+                raise ValueError(n)
+        except ValueError:
+            self.close_connection = True
+            self.send_json(400, {"error": "bad Content-Length"})
+            return
+        raw = self.rfile.read(n) if n else b""
+        if name not in self.api.COMMANDS:
+            self.send_json(404, {"error": f"unknown endpoint {path}"})
+            return
+        # Only JSON: form and text/plain posts are sent cross-site without a preflight
+        if self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+            self.send_json(415, {"error": "Content-Type must be application/json"})
+            return
+        try:
+            result = self.api.command(name, json.loads(raw or b"{}"))
+        except TimeoutError as e:
+            self.send_json(503, {"error": f"{e}; the command was not applied"})
+        except CommandConflict as e:
+            self.send_json(409, {"error": str(e)})
+        except KeyError as e:
+            self.send_json(400, {"error": f"missing field {e}"})
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+        else:
+            self.send_json(200, {"ok": True, "result": result})
+
+    def stream_events(self):
+        """Server-sent events: one `status` event per change, a comment as keep-alive otherwise."""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        seen = -1
+        try:
+            while not self.api.closed:
+                version, payload = self.api.wait_for_change(seen, timeout=15)
+                if version == seen:
+                    self.wfile.write(b": keep-alive\n\n")
+                else:
+                    self.wfile.write(b"event: status\ndata: " + payload + b"\n\n")
+                    seen = version
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+
+class ControlAPI:
+    """Token-protected localhost HTTP API: snapshot reads, SSE push and commands run on the Tk thread."""
+    COMMANDS = ("skip", "jump", "insert", "delete", "set_start")
+
+    def __init__(self, app, token, host="127.0.0.1", port=8765):
+        self.app = app
+        self.token = token
+        self.port = port
+        self.closed = False
+        self.cond = threading.Condition()
+        self.status_version = 0
+        self.status_payload = b"{}"
+        self.schedule_rows = (0, ())
+        self.schedule_payload = (None, b"[]")
+        handler = type("BoundControlAPIHandler", (ControlAPIHandler,), {"api": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.address = f"http://{host}:{port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.closed = True
+        with self.cond:
+            self.cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Published by the Tk thread; references are swapped, never mutated
+    def publish_status(self, status):
+        payload = json.dumps(status).encode("utf-8")
+        with self.cond:
+            if payload == self.status_payload:
+                return
+            self.status_payload = payload
+            self.status_version += 1
+            self.cond.notify_all()
+
+    def publish_schedule(self, version, rows):
+        self.schedule_rows = (version, rows)
+
+    def status_json(self):
+        return self.status_payload
+
+    def schedule_json(self):
+        version, rows = self.schedule_rows
+        cached_version, payload = self.schedule_payload
+        if cached_version != version:
+            keys = ("index", "title", "start", "end", "exact", "repeat")
+            payload = json.dumps([dict(zip(keys, (i,) + r)) for i, r in enumerate(rows)]).encode("utf-8")
+            self.schedule_payload = (version, payload)
+        return payload
+
+    def wait_for_change(self, seen, timeout):
+        with self.cond:
+            if self.status_version == seen and not self.closed:
+                self.cond.wait(timeout)
+            return self.status_version, self.status_payload
+
+    def command(self, name, body):
+        args = body if isinstance(body, dict) else {}
+        if name == "insert":
+            # Probe on this request thread, never on the Tk thread
+            rows = []
+            for it in args.get("items", []):
+                fp = it["filepath"] if isinstance(it, dict) else str(it)
+                dur = float(it.get("duration") or 0) if isinstance(it, dict) else 0.0
+                dur = dur or get_media_duration(fp)
+                if dur <= 0:
+                    raise ValueError(f"could not read duration of {fp}")
+                rows.append({"filepath": fp, "filename": os.path.basename(fp), "duration": dur, "absolute_time": None})
+            args = dict(args, items=rows)
+        return self.app.call_on_ui(getattr(self.app, f"api_{name}"), args)
+
 class PlaylistScheduler:
     PLAYER_SCENE = "Scheduler_Player"
     PLAYER_INPUT = "Scheduler_Player_Input"
     FILLERS_SCENE = "Fillers_Scene"
     FILLERS_INPUT = "Fillers_Playlist"
     LEGACY_PREFIX = "Video_"
+    JOIN_SEEK_THRESHOLD = 2       # seconds late before we seek instead of playing from the top
 
     def __init__(self, root):
         self.root = root
         self.root.title("OBS Playlist Scheduler v2.6 - Live Broadcast Automation")
         self.root.geometry("1480x900")
         # Data
-        self.videos = []              # dicts: filepath, filename, duration, absolute_time
+        self.videos = []              # dicts: filepath, filename, duration, absolute_time, trim_to (optional)
+                                      # or block rows: block, absolute_time, repeat (optional)
         self.clipboard_data = []
+        self.clipboard_block = None   # Block made from the clipboard on first paste
+        self.blocks = {}              # name -> Block referenced by the playlist at the last compaction
+        self.block_serial = 0         # never reused in a session; undo or the clipboard may hold pruned blocks
+        self.history = EditHistory(on_apply=self.on_edit_applied)
+        self.journal = StateJournal(state_dir())
+        self.journaled_blocks = set()
+        self.restoring = False
+        self.resume_on_launch = False
+        self.journaled_settings = None
+        self.tree_iids = []           # Treeview item per row, kept in step with self.videos
+        self.row_keys = []            # what each tree row last showed; None = redraw
+        self.pending_tree_ops = []    # applied edit ops not yet mirrored onto the tree
+        self.iid_seq = 0
+        self.ui_queue = queue.Queue()  # callables for the Tk thread
+        self.ui_updates = {}          # key -> (fn, args); latest wins, applied in batches
+        self.ui_lock = threading.Lock()
+        self.ui_seq = 0
+        self.marked_row = None
+        self.compiled = CompiledSchedule()
+        self.schedule_version = 0
+        self.api = None
         self.fillers = []
+        self.filler_durations = {}    # filler path -> probed duration (seconds)
+        self.filler_last_played = {}  # filler path -> rotation counter
+        self.filler_rotation = 0
+        self.filler_plan = None       # dict: start, end, items, total
+        self.fillers_fingerprint = None  # what was last pushed to the fillers input
         self.broadcasting = False
         self.broadcast_thread = None
         self.obs_client = None
         self.current_video_index = -1
+        self.current_slot = None      # (occurrence start, media offset, filepath) on air; playout thread only
+        self.playout_commands = queue.Queue()
         self.fillers_active = False
+        self.clock = SystemClock()       # SimulatedClock during replay
+        self.replay_clock = None
         # Computed times
         self.abs_starts = []
         self.abs_ends = []
         self.total_duration = 0
+        self.conflicts = analyze_schedule([], [])
         # OBS connection
         self.obs_host_var = tk.StringVar(value="127.0.0.1")
         self.obs_port_var = tk.StringVar(value="4455")
         self.obs_password_var = tk.StringVar(value="")
+        self.api_enabled_var = tk.BooleanVar(value=False)  # opt-in; see start_api
         # Theme
         self.bg = "#2d2d2d"
         self.fg = "#e6e6e6"
@@ -80,9 +981,13 @@ class PlaylistScheduler:
         self.ok = "#66ff99"
         self.warn = "#ffcc66"
         self.err = "#ff6666"
+        self.info = "#66ccff"
         self.setup_ui()
         self.apply_dark_theme()
         self.setup_drag_drop()
+        self.restore_state()
+        self.pump_ui_queue()
+        self.start_api()
 
     # ---------- Utilities ----------
     def _sanitize_name(self, name: str, max_len: int = 64) -> str:
@@ -95,27 +1000,34 @@ class PlaylistScheduler:
         self.abs_ends = []
         if not self.videos:
             self.total_duration = 0
+            self.compiled = CompiledSchedule()
             return
         timed = [(i, v) for i, v in enumerate(self.videos) if v.get('absolute_time') is not None]
         untimed = [(i, v) for i, v in enumerate(self.videos) if v.get('absolute_time') is None]
         timed.sort(key=lambda x: x[1]['absolute_time'])
         sched = {}
+        cur = None
         for i, v in timed:
             s = v['absolute_time']
-            e = s + int(v['duration'])
+            e = s + scheduled_duration(v)
             sched[i] = (s, e)
-        base = self.time_to_seconds(self.start_time_var.get())
-        cur = max((e for (s, e) in sched.values()), default=base)
+            if v.get('repeat'):
+                every, count = v['repeat']
+                e += every * (count - 1)
+            cur = e if cur is None else max(cur, e)
+        if cur is None:
+            cur = self.time_to_seconds(self.start_time_var.get())
         for i, v in untimed:
             s = cur
-            e = s + int(v['duration'])
+            e = s + scheduled_duration(v)
             sched[i] = (s, e)
             cur = e
         for i, v in enumerate(self.videos):
-            s, e = sched.get(i, (0, int(v['duration'])))
+            s, e = sched.get(i, (0, scheduled_duration(v)))
             self.abs_starts.append(s)
             self.abs_ends.append(e)
         self.total_duration = (max(self.abs_ends) - min(self.abs_starts)) if self.abs_starts else 0
+        self.compiled = CompiledSchedule(self.videos, self.abs_starts)
 
     # ---------- Theme ----------
     def apply_dark_theme(self):
@@ -175,30 +1087,39 @@ class PlaylistScheduler:
         tf.columnconfigure(1, weight=1)
         ttk.Label(tf, text="Default Start:").grid(row=0, column=0, padx=(0, 5))
         self.start_time_var = tk.StringVar(value="00:00:00")
-        ttk.Entry(tf, textvariable=self.start_time_var, width=10).grid(row=0, column=1, sticky="w")
+        se = ttk.Entry(tf, textvariable=self.start_time_var, width=10)
+        se.grid(row=0, column=1, sticky="w")
+        # Journal the field when an edit is committed, not on every keystroke
+        se.bind("<Return>", self.journal_settings)
+        se.bind("<FocusOut>", self.journal_settings)
         ttk.Button(left, text="⏰ Set Current Time", command=self.set_current_time).grid(row=6, column=0, pady=2, sticky="ew")
         ttk.Button(left, text="🕐 Set Start for Selected", command=self.set_start_for_selected).grid(row=7, column=0, pady=2, sticky="ew")
         ttk.Button(left, text="🚫 Clear Start for Selected", command=self.clear_start_for_selected).grid(row=8, column=0, pady=1, sticky="ew")
-        ttk.Separator(left).grid(row=9, column=0, sticky="ew", pady=5)
+        ttk.Button(left, text="⚠ Resolve Conflicts", command=self.resolve_conflicts).grid(row=9, column=0, pady=1, sticky="ew")
+        ttk.Separator(left).grid(row=10, column=0, sticky="ew", pady=5)
         # Editing
-        ttk.Label(left, text="✏️ Playlist Editing", font=('Arial', 9, 'bold')).grid(row=10, column=0, pady=(0, 5), sticky="w")
-        ttk.Button(left, text="Move Up", command=self.move_up).grid(row=11, column=0, pady=1, sticky="ew")
-        ttk.Button(left, text="Move Down", command=self.move_down).grid(row=12, column=0, pady=1, sticky="ew")
-        ttk.Button(left, text="Delete Selected", command=self.delete_selected).grid(row=13, column=0, pady=1, sticky="ew")
-        ttk.Button(left, text="Clear All", command=self.clear_all).grid(row=14, column=0, pady=1, sticky="ew")
-        ttk.Separator(left).grid(row=15, column=0, sticky="ew", pady=5)
+        ttk.Label(left, text="✏️ Playlist Editing", font=('Arial', 9, 'bold')).grid(row=11, column=0, pady=(0, 5), sticky="w")
+        ttk.Button(left, text="Move Up", command=self.move_up).grid(row=12, column=0, pady=1, sticky="ew")
+        ttk.Button(left, text="Move Down", command=self.move_down).grid(row=13, column=0, pady=1, sticky="ew")
+        ttk.Button(left, text="Delete Selected", command=self.delete_selected).grid(row=14, column=0, pady=1, sticky="ew")
+        ttk.Button(left, text="Clear All", command=self.clear_all).grid(row=15, column=0, pady=1, sticky="ew")
+        ttk.Separator(left).grid(row=16, column=0, sticky="ew", pady=5)
         # Copy/Paste
         cpf = ttk.Frame(left)
-        cpf.grid(row=16, column=0, sticky="ew")
+        cpf.grid(row=17, column=0, sticky="ew")
         ttk.Button(cpf, text="📋 Copy Block", command=self.copy_block).grid(row=0, column=0, padx=(0, 4), sticky="ew")
         ttk.Button(cpf, text="📥 Paste Block", command=self.paste_block).grid(row=0, column=1, sticky="ew")
+        ttk.Button(cpf, text="🔁 Repeat", command=self.repeat_selected).grid(row=1, column=0, padx=(0, 4), pady=(2, 0), sticky="ew")
+        ttk.Button(cpf, text="🧩 Expand Block", command=self.expand_block).grid(row=1, column=1, pady=(2, 0), sticky="ew")
+        ttk.Button(cpf, text="↶ Undo", command=self.undo).grid(row=2, column=0, padx=(0, 4), pady=(2, 0), sticky="ew")
+        ttk.Button(cpf, text="↷ Redo", command=self.redo).grid(row=2, column=1, pady=(2, 0), sticky="ew")
         cpf.columnconfigure(0, weight=1)
         cpf.columnconfigure(1, weight=1)
-        ttk.Separator(left).grid(row=17, column=0, sticky="ew", pady=5)
+        ttk.Separator(left).grid(row=18, column=0, sticky="ew", pady=5)
         # OBS connection
-        ttk.Label(left, text="🔗 OBS Connection", font=('Arial', 9, 'bold')).grid(row=18, column=0, pady=(0, 5), sticky="w")
+        ttk.Label(left, text="🔗 OBS Connection", font=('Arial', 9, 'bold')).grid(row=19, column=0, pady=(0, 5), sticky="w")
         cf = ttk.Frame(left)
-        cf.grid(row=19, column=0, sticky="ew", pady=(0, 4))
+        cf.grid(row=20, column=0, sticky="ew", pady=(0, 4))
         cf.columnconfigure(1, weight=1)
         ttk.Label(cf, text="Host").grid(row=0, column=0, padx=(0, 5), sticky="w")
         ttk.Entry(cf, textvariable=self.obs_host_var, width=14).grid(row=0, column=1, sticky="ew")
@@ -207,34 +1128,40 @@ class PlaylistScheduler:
         ttk.Label(cf, text="Password").grid(row=2, column=0, padx=(0, 5), sticky="w")
         ttk.Entry(cf, textvariable=self.obs_password_var, show="*", width=14).grid(row=2, column=1, sticky="ew")
         self.connect_btn = ttk.Button(left, text="Connect to OBS", command=self.connect_obs)
-        self.connect_btn.grid(row=20, column=0, pady=2, sticky="ew")
+        self.connect_btn.grid(row=21, column=0, pady=2, sticky="ew")
         self.connection_status = ttk.Label(left, text="● Disconnected", foreground=self.err, font=('Arial', 8))
-        self.connection_status.grid(row=21, column=0, sticky="w")
+        self.connection_status.grid(row=22, column=0, sticky="w")
         self.setup_player_btn = ttk.Button(left, text="🎬 Setup Player Scene", command=self.setup_player_scene)
-        self.setup_player_btn.grid(row=22, column=0, pady=2, sticky="ew")
+        self.setup_player_btn.grid(row=23, column=0, pady=2, sticky="ew")
         self.setup_player_btn.configure(state='disabled')
         self.remove_btn = ttk.Button(left, text="🗑 Remove Your Scenes", command=self.remove_app_scenes)
-        self.remove_btn.grid(row=23, column=0, pady=2, sticky="ew")
+        self.remove_btn.grid(row=24, column=0, pady=2, sticky="ew")
         self.remove_btn.configure(state='disabled')
-        ttk.Separator(left).grid(row=24, column=0, sticky="ew", pady=5)
+        ttk.Separator(left).grid(row=25, column=0, sticky="ew", pady=5)
         # Live broadcast
-        ttk.Label(left, text="🔴 Live Broadcast", font=('Arial', 9, 'bold')).grid(row=25, column=0, pady=(0, 5), sticky="w")
+        ttk.Label(left, text="🔴 Live Broadcast", font=('Arial', 9, 'bold')).grid(row=26, column=0, pady=(0, 5), sticky="w")
         self.start_btn = ttk.Button(left, text="▶ Start Broadcasting", command=self.start_broadcast)
-        self.start_btn.grid(row=26, column=0, pady=2, sticky="ew")
+        self.start_btn.grid(row=27, column=0, pady=2, sticky="ew")
         self.start_btn.configure(state='disabled')
         self.stop_btn = ttk.Button(left, text="⏹ Stop Broadcasting", command=self.stop_broadcast)
-        self.stop_btn.grid(row=27, column=0, pady=2, sticky="ew")
+        self.stop_btn.grid(row=28, column=0, pady=2, sticky="ew")
         self.stop_btn.configure(state='disabled')
         self.skip_btn = ttk.Button(left, text="⏭ Skip to Next", command=self.skip_to_next)
-        self.skip_btn.grid(row=28, column=0, pady=1, sticky="ew")
+        self.skip_btn.grid(row=29, column=0, pady=1, sticky="ew")
         self.skip_btn.configure(state='disabled')
-        ttk.Separator(left).grid(row=29, column=0, sticky="ew", pady=5)
+        ttk.Separator(left).grid(row=30, column=0, sticky="ew", pady=5)
         # Fillers
-        ttk.Label(left, text="🧩 Fillers (loop when idle)", font=('Arial', 9, 'bold')).grid(row=30, column=0, sticky="w")
-        ttk.Button(left, text="➕ Add Fillers", command=self.add_fillers).grid(row=31, column=0, pady=1, sticky="ew")
-        ttk.Button(left, text="🧹 Clear Fillers", command=self.clear_fillers).grid(row=32, column=0, pady=1, sticky="ew")
-        ttk.Separator(left).grid(row=33, column=0, sticky="ew", pady=5)
-        ttk.Button(left, text="💾 Export Playlist", command=self.export_playlist).grid(row=34, column=0, pady=5, sticky="ew")
+        ttk.Label(left, text="🧩 Fillers (loop when idle)", font=('Arial', 9, 'bold')).grid(row=31, column=0, sticky="w")
+        ttk.Button(left, text="➕ Add Fillers", command=self.add_fillers).grid(row=32, column=0, pady=1, sticky="ew")
+        ttk.Button(left, text="🧹 Clear Fillers", command=self.clear_fillers).grid(row=33, column=0, pady=1, sticky="ew")
+        ttk.Separator(left).grid(row=34, column=0, sticky="ew", pady=5)
+        ttk.Button(left, text="💾 Export Playlist", command=self.export_playlist).grid(row=35, column=0, pady=5, sticky="ew")
+        ttk.Button(left, text="🧪 Replay Schedule", command=self.replay_schedule).grid(row=36, column=0, pady=1, sticky="ew")
+        af = ttk.Frame(left)
+        af.grid(row=37, column=0, sticky="ew", pady=(4, 0))
+        af.columnconfigure(0, weight=1)
+        ttk.Checkbutton(af, text="🌐 Control API (localhost)", variable=self.api_enabled_var, command=self.toggle_api).grid(row=0, column=0, sticky="w")
+        ttk.Button(af, text="🔑 Copy Token", command=self.copy_api_token).grid(row=0, column=1, sticky="e")
         # Right panel
         right = ttk.LabelFrame(main, text="🎬 Timeline & Live Status", padding="6")
         right.grid(row=0, column=1, rowspan=2, sticky="nsew")
@@ -257,6 +1184,9 @@ class PlaylistScheduler:
             self.tree.column(c, width=w, anchor=tk.CENTER if c != 'filename' else tk.W)
         scr = ttk.Scrollbar(right, orient=tk.VERTICAL, command=self.tree.yview)
         self.tree.configure(yscrollcommand=scr.set)
+        self.tree.tag_configure('overlap', foreground=self.err)
+        self.tree.tag_configure('past_midnight', foreground=self.warn)
+        self.tree.tag_configure('after_gap', foreground=self.info)
         self.tree.grid(row=2, column=0, sticky="nsew")
         scr.grid(row=2, column=1, sticky="ns")
         # Context menu
@@ -268,19 +1198,27 @@ class PlaylistScheduler:
         self.context_menu.add_separator()
         self.context_menu.add_command(label="Show Properties", command=self.show_properties)
         self.context_menu.add_separator()
+        self.context_menu.add_command(label="Repeat...", command=self.repeat_selected)
+        self.context_menu.add_command(label="Expand Block (editable copy)", command=self.expand_block)
+        self.context_menu.add_command(label="Replace Block Contents with Clipboard", command=self.replace_block_contents)
+        self.context_menu.add_separator()
         self.context_menu.add_command(label="Move Up", command=self.move_up)
         self.context_menu.add_command(label="Move Down", command=self.move_down)
         self.context_menu.add_separator()
         self.context_menu.add_command(label="Delete", command=self.delete_selected)
         self.tree.bind("<Button-3>", self.show_context_menu)
         self.tree.bind("<Double-1>", lambda e: self.set_start_for_selected())
+        self.root.bind("<Control-z>", self.undo)
+        self.root.bind("<Control-y>", self.redo)
+        self.root.bind("<Control-Z>", self.redo)
         self.status_var = tk.StringVar(value="Ready - Set start time and connect to OBS for automation")
         ttk.Label(main, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W).grid(row=2, column=0, columnspan=2, sticky="ew", pady=(10, 0))
         self.update_ui_loop()
 
     # ---------- Time helpers ----------
     def set_current_time(self):
-        self.start_time_var.set(datetime.now().strftime("%H:%M:%S"))
+        self.start_time_var.set(self.clock.now().strftime("%H:%M:%S"))
+        self.journal_settings()
         self.update_timeline()
         self.status_var.set(f"Default start time set to {self.start_time_var.get()}")
 
@@ -314,28 +1252,40 @@ class PlaylistScheduler:
             s = self.time_to_seconds(t)
             if s < 0 or s >= 86400:
                 raise ValueError()
-            # Chain multiple selected items sequentially starting from s
-            current_start = s
-            for i in sorted(sel):
-                if 0 <= i < len(self.videos):
-                    self.videos[i]['absolute_time'] = current_start
-                    current_start += int(self.videos[i]['duration'])
         except Exception:
             messagebox.showerror("Invalid", "Use HH:MM:SS in 24-hour format.")
             return
-        self.update_timeline()
+        self.set_start_for_indices(sel, s)
         self.status_var.set(f"Exact start {t} set for {len(sel)} item(s), chained sequentially")
 
+    def set_start_for_indices(self, indices, start: int):
+        # Chain multiple items sequentially starting from start
+        current_start = start
+        ops = []
+        for i in sorted(indices):
+            if 0 <= i < len(self.videos):
+                v = self.videos[i]
+                ops.append(("set", i, 'absolute_time', current_start))
+                ops.append(("set", i, 'trim_to', UNSET))
+                current_start += scheduled_duration(dict(v, trim_to=None))
+        self.apply_edit(ops, "Set start")
+        self.update_timeline()
+
     def clear_start_for_selected(self):
         sel = self.get_selected_indices()
         if not sel:
             messagebox.showwarning("Clear Start", "Select one or more videos first.")
             return
-        for i in sel:
+        self.clear_start_for_indices(sel)
+        self.status_var.set(f"Cleared exact time for {len(sel)} item(s)")
+
+    def clear_start_for_indices(self, indices):
+        ops = []
+        for i in indices:
             if 0 <= i < len(self.videos):
-                self.videos[i]['absolute_time'] = None
+                ops += [("set", i, 'absolute_time', None), ("set", i, 'trim_to', UNSET), ("set", i, 'repeat', UNSET)]
+        self.apply_edit(ops, "Clear start")
         self.update_timeline()
-        self.status_var.set(f"Cleared exact time for {len(sel)} item(s)")
 
     def context_set_start(self):
         self.set_start_for_selected()
@@ -343,6 +1293,42 @@ class PlaylistScheduler:
     def context_clear_start(self):
         self.clear_start_for_selected()
 
+    def conflict_summary(self):
+        c = self.conflicts
+        parts = []
+        if c["overlaps"]:
+            parts.append(f"{len(c['overlaps'])} overlap(s)")
+        if c["gaps"]:
+            parts.append(f"{len(c['gaps'])} gap(s)")
+        if c["past_midnight"]:
+            parts.append(f"{len(c['past_midnight'])} item(s) past midnight")
+        return ", ".join(parts)
+
+    def resolve_conflicts(self):
+        c = self.conflicts
+        if not c["overlaps"]:
+            summary = self.conflict_summary()
+            messagebox.showinfo("Resolve Conflicts", f"No overlapping items.\n\n{summary}" if summary else "No overlapping items.")
+            return
+        lines = [f"{row_title(self.videos[a])} overlaps {row_title(self.videos[b])} by {self.format_duration(sec)}" for a, b, sec in c["overlaps"][:10]]
+        if len(c["overlaps"]) > 10:
+            lines.append(f"... and {len(c['overlaps']) - 10} more")
+        policy = simpledialog.askstring(
+            "Resolve Conflicts",
+            "\n".join(lines) + "\n\nPolicy: push (start later item when the earlier ends), trim (cut the earlier item short) or drop (remove the later item)",
+            initialvalue="push"
+        )
+        if not policy:
+            return
+        policy = policy.strip().lower()
+        if policy not in ("push", "trim", "drop"):
+            messagebox.showerror("Invalid", "Use push, trim or drop.")
+            return
+        changed = self.apply_edit(resolve_overlaps(self.videos, self.abs_starts, self.abs_ends, policy), f"Resolve conflicts ({policy})")
+        self.update_timeline()
+        remaining = len(self.conflicts["overlaps"])
+        self.status_var.set(f"Resolved {changed} conflict(s) with '{policy}'" + (f", {remaining} overlap(s) left" if remaining else ""))
+
     # ---------- DnD ----------
     def setup_drag_drop(self):
         try:
@@ -360,19 +1346,20 @@ class PlaylistScheduler:
 
     # ---------- File Addition ----------
     def add_files(self, files):
-        added = 0
+        rows = []
         for f in files:
             if os.path.isfile(f):
                 duration = get_media_duration(f)
                 if duration > 0:
-                    self.videos.append({
+                    rows.append({
                         "filepath": f,
                         "filename": os.path.basename(f),
                         "duration": duration,
                         "absolute_time": None
                     })
-                    added += 1
+        added = len(rows)
         if added > 0:
+            self.apply_edit([("splice", len(self.videos), 0, rows)], f"Add {added} video(s)")
             self.update_timeline()
             self.status_var.set(f"Added {added} video(s)")
             if self.obs_client:
@@ -395,49 +1382,125 @@ class PlaylistScheduler:
     # ---------- Timeline Update ----------
     def update_timeline(self):
         self.recompute_schedule_times()
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.conflicts = analyze_schedule(self.abs_starts, self.abs_ends, [v.get('repeat') for v in self.videos])
+        tags = {}
+        for i in self.conflicts["past_midnight"]:
+            tags[i] = ('past_midnight',)
+        for _, _, i in self.conflicts["gaps"]:
+            tags[i] = ('after_gap',)
+        for a, b, _ in self.conflicts["overlaps"]:
+            tags[a] = tags[b] = ('overlap',)
+        if not self.sync_tree():
+            self.tree.delete(*self.tree.get_children())
+            self.tree_iids = [None] * len(self.videos)
+            self.row_keys = [None] * len(self.videos)
+        iids, keys = self.tree_iids, self.row_keys
+        self.marked_row = None
+        # Only rows whose shown state changed are touched, so small edits stay cheap on long playlists
         for i, v in enumerate(self.videos):
-            status = '▶' if i == self.current_video_index else ''
-            dur = self.format_duration(v['duration'])
-            start = self.format_time_or_auto(self.abs_starts[i], v.get('absolute_time') is not None)
-            end = self.format_duration(self.abs_ends[i])
-            self.tree.insert('', tk.END, values=(status, v['filename'], dur, start, end))
+            on_air = i == self.current_video_index
+            key = (id(v), self.abs_starts[i], self.abs_ends[i], v.get('absolute_time') is not None, v.get('repeat'), tags.get(i, ()), on_air)
+            if keys[i] != key:
+                keys[i] = key
+                dur = self.format_duration(scheduled_duration(v))
+                start = self.format_time_or_auto(self.abs_starts[i], v.get('absolute_time') is not None)
+                if v.get('repeat'):
+                    start = f"↻{start}"
+                end = self.format_duration(self.abs_ends[i])
+                values = ('▶' if on_air else '', row_title(v), dur, start, end)
+                if iids[i] is None:
+                    iids[i] = self.new_tree_row(tk.END, values=values, tags=tags.get(i, ()))
+                else:
+                    self.tree.item(iids[i], values=values, tags=tags.get(i, ()))
+            if on_air:
+                self.marked_row = iids[i]
+        self.publish_schedule()
+        summary = self.conflict_summary()
+        if summary:
+            self.status_var.set(f"⚠ {summary}")
         if self.videos and self.obs_client:
             self.start_btn.configure(state='normal')
         else:
             self.start_btn.configure(state='disabled')
 
+    def new_tree_row(self, index, **kw):
+        self.iid_seq += 1
+        return self.tree.insert('', index, iid=f"r{self.iid_seq}", **kw)
+
+    def on_edit_applied(self, ops):
+        self.pending_tree_ops.extend(ops)
+        self.journal_ops(ops)
+
+    def sync_tree(self):
+        """Mirror applied edit ops onto the Treeview; False when it no longer matches and must be rebuilt."""
+        ops, self.pending_tree_ops = self.pending_tree_ops, []
+        iids, keys = self.tree_iids, self.row_keys
+        blocks = set()
+        try:
+            for op in ops:
+                kind = op[0]
+                if kind == "splice":
+                    _, i, n, rows = op
+                    if n:
+                        self.tree.delete(*[x for x in iids[i:i + n] if x is not None])
+                    iids[i:i + n] = [self.new_tree_row(i + k) for k in range(len(rows))]
+                    keys[i:i + n] = [None] * len(rows)
+                elif kind == "swap":
+                    a, b = sorted(op[1:])
+                    if a != b:
+                        # move() counts positions without the moved item, so this swaps a and b
+                        self.tree.move(iids[b], '', a)
+                        self.tree.move(iids[a], '', b)
+                        iids[a], iids[b] = iids[b], iids[a]
+                        keys[a], keys[b] = keys[b], keys[a]
+                elif kind == "set":
+                    keys[op[1]] = None
+                elif kind == "items":
+                    blocks.add(op[1])
+        except (tk.TclError, IndexError, TypeError):
+            return False
+        if len(iids) != len(self.videos) or None in iids:
+            return False
+        if blocks:
+            for i, v in enumerate(self.videos):
+                if v.get('block') in blocks:
+                    keys[i] = None
+        return True
+
     # ---------- UI loop ----------
     def update_ui_loop(self):
         if self.broadcasting and self.abs_starts:
-            now = seconds_since_midnight()
+            now = self.clock.seconds_since_midnight()
             tele = max(0, now - min(self.abs_starts))
             self.time_label.configure(text=f"Elapsed: {self.format_duration(tele)}")
         else:
             self.time_label.configure(text="")
         try:
-            if self.obs_client:
+            # While broadcasting the playout thread polls OBS and posts the result
+            if self.obs_client and not self.broadcasting:
                 input_name = self.PLAYER_INPUT if self.is_player_ready() and 0 <= self.current_video_index < len(self.videos) else (self.FILLERS_INPUT if self.fillers_active else None)
                 if input_name:
                     st = self.obs_client.get_media_input_status(input_name)
-                    data = getattr(st, "responseData", None) or {}
-                    cur = int(data.get("mediaCursor", 0))
-                    dur = int(data.get("mediaDuration", 0))
-                    state = data.get("mediaState", "")
-                    ps = cur // 1000
-                    ts = dur // 1000
-                    rem = max(ts - ps, 0)
-                    if self.fillers_active:
-                        self.file_time_label.configure(text="Fillers are playing (advertisements)")
-                    else:
-                        self.file_time_label.configure(text=f"File: {self.format_duration(ps)} / {self.format_duration(ts)}  (−{self.format_duration(rem)}) [{state}]")
+                    self.show_media_status(getattr(st, "responseData", None) or {})
                 else:
                     self.file_time_label.configure(text="Fillers are playing (advertisements)" if self.fillers_active else "Nothing is playing")
         except Exception:
             pass
+        self.publish_status()
         self.root.after(1000, self.update_ui_loop)
 
+    def show_media_status(self, data):
+        if self.fillers_active:
+            self.file_time_label.configure(text="Fillers are playing (advertisements)")
+            return
+        cur = int(data.get("mediaCursor", 0))
+        dur = int(data.get("mediaDuration", 0))
+        state = data.get("mediaState", "")
+        ps = cur // 1000
+        ts = dur // 1000
+        rem = max(ts - ps, 0)
+        self.file_time_label.configure(text=f"File: {self.format_duration(ps)} / {self.format_duration(ts)}  (−{self.format_duration(rem)}) [{state}]")
+
     # ---------- Context Menu ----------
     def show_context_menu(self, event):
         try:
@@ -450,11 +1513,20 @@ class PlaylistScheduler:
         if sel:
             index = self.tree.index(sel[0])
             v = self.videos[index]
-            msg = f"Filename: {v['filename']}\nPath: {v['filepath']}\nDuration: {self.format_duration(v['duration'])}\nAbsolute Time: {v.get('absolute_time')}"
+            if 'block' in v:
+                blk = v['block']
+                users = sum(1 for r in self.videos if r.get('block') is blk)
+                items = "\n".join(f"  {m['filename']} ({self.format_duration(scheduled_duration(m))})" for m in blk.items[:20])
+                more = f"\n  ... and {len(blk.items) - 20} more" if len(blk.items) > 20 else ""
+                msg = f"Block: {blk.name}\nShared by {users} row(s)\nDuration: {self.format_duration(blk.duration)}\nAbsolute Time: {v.get('absolute_time')}\nRepeat: {v.get('repeat')}\n\n{items}{more}"
+                messagebox.showinfo("Properties", msg)
+                return
+            msg = f"Filename: {v['filename']}\nPath: {v['filepath']}\nDuration: {self.format_duration(v['duration'])}\nAbsolute Time: {v.get('absolute_time')}\nTrimmed To: {v.get('trim_to')}\nRepeat: {v.get('repeat')}"
             messagebox.showinfo("Properties", msg)
 
     # ---------- OBS connection ----------
-    def connect_obs(self):
+    def connect_obs(self, quiet=False):
+        """Connect with the current settings; returns the error instead of showing it when quiet."""
         try:
             if self.obs_client:
                 try:
@@ -467,7 +1539,8 @@ class PlaylistScheduler:
             except Exception:
                 port = 4455
             password = self.obs_password_var.get()
-            self.obs_client = obs.ReqClient(host=host, port=port, password=password, timeout=4)
+            self.invalidate_fillers_cache()
+            self.obs_client = LockedClient(obs.ReqClient(host=host, port=port, password=password, timeout=4))
             v = self.obs_client.get_version()
             self.connection_status.configure(text="● Connected", foreground=self.ok)
             self.connect_btn.configure(text="Disconnect", command=self.disconnect_obs)
@@ -475,10 +1548,13 @@ class PlaylistScheduler:
             self.remove_btn.configure(state='normal')
             if self.videos:
                 self.start_btn.configure(state='normal')
+            self.journal_settings()
             self.status_var.set(f"Connected to OBS {v.obs_version} at {host}:{port}")
         except Exception as e:
-            messagebox.showerror("Connection Failed", f"Could not connect:\n\n{e}\n\nEnable OBS WebSocket and verify port/password.")
+            if not quiet:
+                messagebox.showerror("Connection Failed", f"Could not connect:\n\n{e}\n\nEnable OBS WebSocket and verify port/password.")
             self.disconnect_obs()
+            return e
 
     def disconnect_obs(self):
         if self.broadcasting:
@@ -489,6 +1565,7 @@ class PlaylistScheduler:
             except Exception:
                 pass
             self.obs_client = None
+        self.invalidate_fillers_cache()
         self.connection_status.configure(text="● Disconnected", foreground=self.err)
         self.connect_btn.configure(text="Connect to OBS", command=self.connect_obs)
         self.setup_player_btn.configure(state='disabled')
@@ -502,34 +1579,38 @@ class PlaylistScheduler:
             messagebox.showwarning("Setup Player", "Connect to OBS first.")
             return
         try:
-            try:
-                self.obs_client.create_scene(self.PLAYER_SCENE)
-            except Exception:
-                pass
-            try:
-                self.obs_client.remove_input(self.PLAYER_INPUT)
-            except Exception:
-                pass
-            self.obs_client.create_input(
-                self.PLAYER_SCENE,
-                self.PLAYER_INPUT,
-                "ffmpeg_source",
-                {
-                    "local_file": "",
-                    "is_local_file": True,
-                    "looping": False,
-                    "restart_on_activate": True,
-                    "clear_on_media_end": False,
-                    "close_when_inactive": False,
-                    "hardware_decode": False
-                },
-                True
-            )
+            self.create_player_input()
             self.status_var.set("Player scene ready")
             messagebox.showinfo("Player Scene", "Player created. Use Start Broadcasting.")
         except Exception as e:
             messagebox.showerror("Player Scene", f"Error creating player:\n{e}")
 
+    def create_player_input(self):
+        """OBS side of the player setup; safe to call from the playout thread."""
+        try:
+            self.obs_client.create_scene(self.PLAYER_SCENE)
+        except Exception:
+            pass
+        try:
+            self.obs_client.remove_input(self.PLAYER_INPUT)
+        except Exception:
+            pass
+        self.obs_client.create_input(
+            self.PLAYER_SCENE,
+            self.PLAYER_INPUT,
+            "ffmpeg_source",
+            {
+                "local_file": "",
+                "is_local_file": True,
+                "looping": False,
+                "restart_on_activate": True,
+                "clear_on_media_end": False,
+                "close_when_inactive": False,
+                "hardware_decode": False
+            },
+            True
+        )
+
     def is_player_ready(self):
         try:
             self.obs_client.get_input_settings(self.PLAYER_INPUT)
@@ -537,25 +1618,56 @@ class PlaylistScheduler:
         except Exception:
             return False
 
-    def play_item_on_player(self, idx: int):
-        if not (0 <= idx < len(self.videos)):
-            return
+    def play_item_on_player(self, idx: int, media, offset: float = 0, start: int = 0):
+        """Put one compiled media item on air, joining `offset` seconds in. Playout thread; never touches Tk."""
         try:
             if not self.is_player_ready():
-                self.setup_player_scene()
-            file_path = os.path.abspath(self.videos[idx]['filepath']).replace('\\', '/')
+                self.create_player_input()
+            _, filepath, filename = media
+            file_path = os.path.abspath(filepath).replace('\\', '/')
             self.obs_client.set_input_settings(self.PLAYER_INPUT, {"local_file": file_path, "is_local_file": True}, True)
             self.obs_client.set_current_program_scene(self.PLAYER_SCENE)
             self.obs_client.trigger_media_input_action(self.PLAYER_INPUT, "OBS_WEBSOCKET_MEDIA_INPUT_ACTION_RESTART")
-            fn = self.videos[idx]['filename']
-            self.live_status_label.configure(text=f"🔴 NOW: {fn}", foreground=self.err)
-            for ch in self.tree.get_children():
-                self.tree.set(ch, 'status', '')
-            if 0 <= idx < len(self.tree.get_children()):
-                self.tree.set(self.tree.get_children()[idx], 'status', '▶')
+            if offset >= self.JOIN_SEEK_THRESHOLD:
+                self.seek_player(start + media[0])
+            self.current_slot = (start, media[0], filepath)
+            self.fillers_active = False
+            self.post_ui(self.show_on_air, idx, f"🔴 NOW: {filename}", self.err, key="on_air")
         except Exception as e:
             print(f"Player error: {e}")
 
+    def show_on_air(self, idx: int, text: str, color: str, file_text: str = None):
+        """Tk side of a playout switch: status labels and the ▶ marker on the playing row."""
+        if idx >= 0 and not self.broadcasting:
+            return  # posted by a playout thread that has since been stopped
+        self.current_video_index = idx
+        self.live_status_label.configure(text=text, foreground=color)
+        if file_text is not None:
+            self.file_time_label.configure(text=file_text)
+        if self.marked_row is not None and self.tree.exists(self.marked_row):
+            self.tree.set(self.marked_row, 'status', '')
+        self.marked_row = None
+        if 0 <= idx < len(self.tree_iids) and self.tree.exists(self.tree_iids[idx]):
+            self.tree.set(self.tree_iids[idx], 'status', '▶')
+            self.marked_row = self.tree_iids[idx]
+
+    def seek_player(self, media_start: int):
+        """Seek the player to the schedule's current offset into the media starting at media_start."""
+        for _ in range(20):
+            try:
+                st = self.obs_client.get_media_input_status(self.PLAYER_INPUT)
+                data = getattr(st, "responseData", None) or {}
+                if data.get("mediaState") == "OBS_MEDIA_STATE_PLAYING" and data.get("mediaDuration"):
+                    break
+            except Exception:
+                pass
+            time.sleep(0.05)
+        try:
+            offset = (self.clock.time_of_day() - media_start) % 86400
+            self.obs_client.set_media_input_cursor(self.PLAYER_INPUT, int(offset * 1000))
+        except Exception as e:
+            print(f"Player seek error: {e}")
+
     # ---------- Fillers ----------
     def add_fillers(self):
         files = filedialog.askopenfilenames(
@@ -565,18 +1677,88 @@ class PlaylistScheduler:
         if not files:
             return
         self.fillers = list(files)
+        self.filler_durations = {p: get_media_duration(p) for p in self.fillers}
+        self.filler_plan = None
+        self.journal_fillers()
         self.status_var.set(f"Fillers set: {len(self.fillers)} item(s)")
         if self.obs_client:
             self.ensure_fillers_scene()
 
     def clear_fillers(self):
         self.fillers = []
+        self.filler_durations = {}
+        self.filler_plan = None
+        self.journal_fillers()
         self.status_var.set("Fillers cleared")
 
-    def ensure_fillers_scene(self):
-        if not self.obs_client:
+    def gap_end_after(self, t: int):
+        """Start of the next scheduled item after t, or None when nothing else is scheduled."""
+        return self.compiled.next_occurrence(t)[1]
+
+    def build_filler_plan(self, start: int, end: int):
+        items, total = plan_filler_sequence(end - start, self.filler_durations, self.filler_last_played)
+        if not items:
+            return None
+        return {"start": start, "end": end, "items": items, "total": total}
+
+    def prepare_filler_plan(self, gap_start: int):
+        """Plan the fillers for the gap starting at gap_start while the current item is still on air."""
+        if not self.fillers or self.index_for_time(gap_start) is not None:
+            return
+        end = self.gap_end_after(gap_start)
+        if end is None:
+            return
+        plan = self.filler_plan
+        if plan and plan["start"] == gap_start and plan["end"] == end:
+            return
+        self.filler_plan = self.build_filler_plan(gap_start, end)
+        if self.filler_plan:
+            self.ensure_fillers_scene(self.filler_plan)
+
+    def current_filler_plan(self, now: int):
+        """Plan for the gap we are in at `now`; reuses the precomputed plan when we are at its start."""
+        end = self.gap_end_after(now)
+        if end is None:
+            return None
+        plan = self.filler_plan
+        if plan and plan["end"] == end and 0 <= now - plan["start"] <= 2:
+            return plan
+        self.filler_plan = self.build_filler_plan(now, end)
+        return self.filler_plan
+
+    def mark_fillers_played(self, plan):
+        for p in plan["items"]:
+            self.filler_rotation += 1
+            self.filler_last_played[p] = self.filler_rotation
+
+    def invalidate_fillers_cache(self):
+        self.fillers_fingerprint = None
+
+    def ensure_fillers_scene(self, plan=None):
+        """Create or update the fillers input with a queued plan, or loop all fillers without one."""
+        if not self.obs_client or not self.fillers:
             return
         try:
+            if plan or len(self.fillers) > 1:
+                kind = "vlc_source"
+                entries = plan["items"] if plan else self.fillers
+                playlist = [{"value": os.path.abspath(p).replace('\\', '/'), "hidden": False, "selected": True} for p in entries]
+                settings = {"playlist": playlist, "loop": plan is None, "shuffle": False, "playback_behavior": "stop_restart"}
+            else:
+                kind = "ffmpeg_source"
+                fp = os.path.abspath(self.fillers[0]).replace('\\', '/')
+                settings = {
+                    "local_file": fp,
+                    "is_local_file": True,
+                    "looping": True,
+                    "restart_on_activate": True,
+                    "clear_on_media_end": False,
+                    "close_when_inactive": False,
+                    "hardware_decode": False
+                }
+            fingerprint = (id(self.obs_client), kind, json.dumps(settings, sort_keys=True))
+            if fingerprint == self.fillers_fingerprint:
+                return
             try:
                 self.obs_client.create_scene(self.FILLERS_SCENE)
             except Exception:
@@ -585,16 +1767,18 @@ class PlaylistScheduler:
             try:
                 li = self.obs_client.get_input_list()
                 data = getattr(li, "responseData", None) or {}
-                existing = {i.get("inputName") for i in data.get("inputs", []) if isinstance(i, dict)}
+                existing = {i.get("inputName"): i.get("unversionedInputKind") or i.get("inputKind") for i in data.get("inputs", []) if isinstance(i, dict)}
             except Exception:
-                existing = set()
+                existing = {}
+            if self.FILLERS_INPUT in existing and existing[self.FILLERS_INPUT] not in (None, kind):
+                # A single looping file and a queued plan need different source kinds
+                try:
+                    self.obs_client.remove_input(self.FILLERS_INPUT)
+                except Exception:
+                    pass
+                existing.pop(self.FILLERS_INPUT, None)
             if self.FILLERS_INPUT in existing:
-                if len(self.fillers) > 1:
-                    playlist = [{"value": os.path.abspath(p).replace('\\', '/'), "hidden": False, "selected": True} for p in self.fillers]
-                    self.obs_client.set_input_settings(self.FILLERS_INPUT, {"playlist": playlist, "loop": True, "shuffle": False, "playback_behavior": "always_play"}, True)
-                else:
-                    fp = os.path.abspath(self.fillers[0]).replace('\\', '/')
-                    self.obs_client.set_input_settings(self.FILLERS_INPUT, {"local_file": fp, "is_local_file": True, "looping": True, "restart_on_activate": True}, True)
+                self.obs_client.set_input_settings(self.FILLERS_INPUT, settings, True)
                 # Ensure present in scene
                 try:
                     sl = self.obs_client.get_scene_item_list(self.FILLERS_SCENE)
@@ -605,22 +1789,11 @@ class PlaylistScheduler:
                 except Exception:
                     pass
             else:
-                if len(self.fillers) > 1:
-                    playlist = [{"value": os.path.abspath(p).replace('\\', '/'), "hidden": False, "selected": True} for p in self.fillers]
-                    self.obs_client.create_input(self.FILLERS_SCENE, self.FILLERS_INPUT, "vlc_source", {"playlist": playlist, "loop": True, "shuffle": False, "playback_behavior": "always_play"}, True)
-                else:
-                    fp = os.path.abspath(self.fillers[0]).replace('\\', '/')
-                    self.obs_client.create_input(self.FILLERS_SCENE, self.FILLERS_INPUT, "ffmpeg_source", {
-                        "local_file": fp,
-                        "is_local_file": True,
-                        "looping": True,
-                        "restart_on_activate": True,
-                        "clear_on_media_end": False,
-                        "close_when_inactive": False,
-                        "hardware_decode": False
-                    }, True)
-            self.status_var.set("Fillers ready")
+                self.obs_client.create_input(self.FILLERS_SCENE, self.FILLERS_INPUT, kind, settings, True)
+            self.fillers_fingerprint = fingerprint
+            self.post_ui(self.status_var.set, "Fillers ready", key="status")
         except Exception as e:
+            self.fillers_fingerprint = None
             print(f"Fillers setup warning: {e}")
 
     def play_fillers_if_needed(self):
@@ -628,19 +1801,33 @@ class PlaylistScheduler:
             return
         if not self.fillers:
             self.fillers_active = False
-            self.live_status_label.configure(text="Nothing is playing", foreground=self.fg)
-            self.file_time_label.configure(text="Nothing is playing")
+            self.post_ui(self.show_on_air, -1, "Nothing is playing", self.fg, "Nothing is playing", key="on_air")
             return
-        self.ensure_fillers_scene()
+        plan = self.current_filler_plan(self.clock.seconds_since_midnight()) if self.broadcasting else None
+        self.ensure_fillers_scene(plan)
         try:
-            self.obs_client.set_current_program_scene(self.FILLERS_SCENE)
-            self.obs_client.trigger_media_input_action(self.FILLERS_INPUT, "OBS_WEBSOCKET_MEDIA_INPUT_ACTION_RESTART")
+            try:
+                self.switch_to_fillers()
+            except Exception:
+                # OBS may have lost the input behind our back; push again and retry once
+                self.invalidate_fillers_cache()
+                self.ensure_fillers_scene(plan)
+                self.switch_to_fillers()
             self.fillers_active = True
-            self.live_status_label.configure(text="Fillers are playing (advertisements)", foreground=self.warn)
-            self.file_time_label.configure(text="Fillers are playing (advertisements)")
+            if plan:
+                self.mark_fillers_played(plan)
+                self.post_ui(self.status_var.set, f"Fillers: {len(plan['items'])} ad(s), {self.format_duration(plan['total'])} of {self.format_duration(plan['end'] - plan['start'])} gap", key="status")
+            text = "Fillers are playing (advertisements)"
+            self.post_ui(self.show_on_air, -1, text, self.warn, text, key="on_air")
         except Exception as e:
             print(f"Filler playback error: {e}")
 
+    def switch_to_fillers(self):
+        # Both filler sources restart on activation, so a scene switch is enough unless we are already on air
+        self.obs_client.set_current_program_scene(self.FILLERS_SCENE)
+        if self.fillers_active:
+            self.obs_client.trigger_media_input_action(self.FILLERS_INPUT, "OBS_WEBSOCKET_MEDIA_INPUT_ACTION_RESTART")
+
     # ---------- Broadcast control ----------
     def start_broadcast(self):
         if not self.obs_client:
@@ -654,26 +1841,27 @@ class PlaylistScheduler:
         self.broadcasting = True
         self.fillers_active = False
         self.current_video_index = -1
+        self.current_slot = None
+        self.playout_commands = queue.Queue()
+        # The playout thread joins the schedule in progress on its first pass
         self.broadcast_thread = threading.Thread(target=self.broadcast_controller, daemon=True)
         self.broadcast_thread.start()
         self.start_btn.configure(state='disabled')
         self.stop_btn.configure(state='normal')
         self.skip_btn.configure(state='normal')
         self.remove_btn.configure(state='disabled')
-        now = seconds_since_midnight()
-        idx = self.index_for_time(now)
-        if idx is not None:
-            self.play_item_on_player(idx)
-            self.current_video_index = idx
-        else:
-            self.play_fillers_if_needed()
         self.live_status_label.configure(text="🔴 BROADCASTING LIVE", foreground=self.err)
         self.status_var.set("🔴 Live broadcast active")
+        self.journal_playout()
 
     def stop_broadcast(self):
         self.broadcasting = False
+        self.journal_playout()
         if self.broadcast_thread:
             self.broadcast_thread.join(timeout=1)
+        # Drop what the playout thread posted but the pump has not applied yet
+        with self.ui_lock:
+            self.ui_updates.clear()
         self.play_fillers_if_needed()
         self.start_btn.configure(state='normal')
         self.stop_btn.configure(state='disabled')
@@ -683,57 +1871,107 @@ class PlaylistScheduler:
         self.update_timeline()
         self.status_var.set("Broadcast stopped")
 
+    def occurrence_for_time(self, now_sod: int):
+        """(row, start, end) of the occurrence on air at now_sod, or None."""
+        return self.compiled.occurrence_at(now_sod)
+
     def index_for_time(self, now_sod: int):
-        if not self.videos or not self.abs_starts:
-            return None
-        for i, (s, e) in enumerate(zip(self.abs_starts, self.abs_ends)):
-            if s <= now_sod < e:
-                return i
-        return None
+        occ = self.occurrence_for_time(now_sod)
+        return occ[0] if occ else None
 
     def broadcast_controller(self):
+        """Playout thread: follows the compiled schedule on self.clock and talks to OBS only."""
+        clock = self.clock
+        free = object()
+        hold = free
+        last_poll = 0.0
+        wait = 0  # first pass goes on air straight away
+        until = None
         while self.broadcasting:
             try:
-                now = seconds_since_midnight()
-                target = self.index_for_time(now)
-                if target is not None and target != self.current_video_index:
-                    self.play_item_on_player(target)
-                    self.current_video_index = target
-                    self.fillers_active = False
-                if target is None and not self.fillers_active:
-                    self.play_fillers_if_needed()
-                    self.current_video_index = -1
-                time.sleep(0.5)
+                try:
+                    cmd = clock.wait(self.playout_commands, wait, until)
+                except queue.Empty:
+                    cmd = None
+                if not self.broadcasting:
+                    break
+                wait = 0.5
+                sched = self.compiled
+                now = clock.seconds_since_midnight()
+                occ = sched.occurrence_at(now)
+                scheduled = None
+                if occ is not None:
+                    target, s, e = occ
+                    media, offset = sched.media_at(target, now - s)
+                    scheduled = (s, media[0], media[1])
+                if cmd is not None:
+                    hold = scheduled
+                    self.run_playout_command(sched, cmd, now)
+                elif hold is free or scheduled != hold:
+                    hold = free
+                    if occ is None:
+                        if not self.fillers_active:
+                            self.current_slot = None
+                            self.play_fillers_if_needed()
+                    elif scheduled != self.current_slot:
+                        # Join in progress: start mid-item if the schedule says it began earlier
+                        self.play_item_on_player(target, media, offset, s)
+                if occ is not None:
+                    # Plan the gap after this item ahead of time, not at the switch
+                    self.prepare_filler_plan(e)
+                until = sched.next_change(now)
+                if clock.monotonic() - last_poll >= 1:
+                    last_poll = clock.monotonic()
+                    self.poll_media_status()
             except Exception as e:
                 print(f"Broadcast controller error: {e}")
                 time.sleep(1)
 
+    def run_playout_command(self, sched, cmd, now):
+        if cmd[0] == "skip":
+            idx, start = sched.next_occurrence(now)
+        else:
+            idx = cmd[1] if 0 <= cmd[1] < len(sched.rows) else None
+            start = sched.rows[idx][0] if idx is not None else None
+        if idx is None:
+            self.current_slot = None
+            self.play_fillers_if_needed()
+            return
+        media, _ = sched.media_at(idx, 0)
+        self.play_item_on_player(idx, media, 0, start)
+
+    def poll_media_status(self):
+        input_name = self.FILLERS_INPUT if self.fillers_active else (self.PLAYER_INPUT if self.current_slot else None)
+        if not input_name or not self.obs_client:
+            return
+        try:
+            st = self.obs_client.get_media_input_status(input_name)
+            self.post_ui(self.show_media_status, getattr(st, "responseData", None) or {}, key="media")
+        except Exception:
+            pass
+
     def skip_to_next(self):
         if not self.broadcasting:
             return
-        now = seconds_since_midnight()
-        next_idx = None
-        for i, s in enumerate(self.abs_starts):
-            if s > now:
-                next_idx = i
-                break
-        if next_idx is not None:
-            self.play_item_on_player(next_idx)
-            self.current_video_index = next_idx
-        else:
-            self.play_fillers_if_needed()
-            self.current_video_index = -1
+        self.playout_commands.put(("skip",))
+
+    def next_occurrence(self, now_sod: int):
+        """(row, start) of the next occurrence starting after now_sod, or (None, None)."""
+        return self.compiled.next_occurrence(now_sod)
 
     def jump_to_video(self):
         """Context menu action: jump to the selected item immediately."""
         sel = self.tree.selection()
         if not sel:
             return
-        index = self.tree.index(sel[0])
+        self.jump_to_index(self.tree.index(sel[0]))
+
+    def jump_to_index(self, index: int):
+        if not (0 <= index < len(self.videos)):
+            return
         if not self.broadcasting:
             self.start_broadcast()
-        self.play_item_on_player(index)
-        self.current_video_index = index
+        self.playout_commands.put(("jump", index))
 
     # ---------- Remove app scenes ----------
     def remove_app_scenes(self):
@@ -776,12 +2014,33 @@ class PlaylistScheduler:
                         removed += 1
                     except Exception as e:
                         print(f"Remove failed for {n}: {e}")
+                self.invalidate_fillers_cache()
                 self.status_var.set(f"Removed {removed} app scenes")
                 messagebox.showinfo("Remove Scenes", f"Removed {removed} scenes.")
         except Exception as e:
             messagebox.showerror("Remove Scenes", f"Error: {e}")
 
     # ---------- Editing ----------
+    def apply_edit(self, ops, label):
+        """Apply playlist edit operations and record their inverse for undo."""
+        return self.history.apply(self.videos, ops, label)
+
+    def undo(self, event=None):
+        label = self.history.undo(self.videos)
+        if label is None:
+            self.status_var.set("Nothing to undo")
+            return
+        self.update_timeline()
+        self.status_var.set(f"Undid: {label}")
+
+    def redo(self, event=None):
+        label = self.history.redo(self.videos)
+        if label is None:
+            self.status_var.set("Nothing to redo")
+            return
+        self.update_timeline()
+        self.status_var.set(f"Redid: {label}")
+
     def get_selected_indices(self):
         return [self.tree.index(i) for i in self.tree.selection()]
 
@@ -789,16 +2048,14 @@ class PlaylistScheduler:
         idx = self.get_selected_indices()
         if not idx or idx[0] == 0:
             return
-        for i in idx:
-            self.videos[i - 1], self.videos[i] = self.videos[i], self.videos[i - 1]
+        self.apply_edit([("swap", i - 1, i) for i in idx], "Move up")
         self.update_timeline()
 
     def move_down(self):
         idx = self.get_selected_indices()
         if not idx or idx[-1] == len(self.videos) - 1:
             return
-        for i in reversed(idx):
-            self.videos[i + 1], self.videos[i] = self.videos[i], self.videos[i + 1]
+        self.apply_edit([("swap", i + 1, i) for i in reversed(idx)], "Move down")
         self.update_timeline()
 
     def delete_selected(self):
@@ -806,13 +2063,17 @@ class PlaylistScheduler:
         if not idx:
             return
         if messagebox.askyesno("Confirm", f"Delete {len(idx)} videos?"):
-            for i in reversed(idx):
-                del self.videos[i]
-            self.update_timeline()
+            self.delete_indices(idx)
+
+    def delete_indices(self, indices):
+        idx = sorted({i for i in indices if 0 <= i < len(self.videos)}, reverse=True)
+        self.apply_edit([("splice", i, 1, []) for i in idx], f"Delete {len(idx)} item(s)")
+        self.update_timeline()
+        return len(idx)
 
     def clear_all(self):
         if self.videos and messagebox.askyesno("Clear All", "Clear entire playlist?"):
-            self.videos.clear()
+            self.apply_edit([("splice", 0, len(self.videos), [])], "Clear all")
             self.update_timeline()
             if self.obs_client and self.fillers:
                 self.play_fillers_if_needed()
@@ -822,17 +2083,556 @@ class PlaylistScheduler:
         if not idx:
             return
         self.clipboard_data = [self.videos[i].copy() for i in idx]
+        self.clipboard_block = None
         self.status_var.set(f"Copied {len(idx)} item(s)")
 
+    def new_block(self, items):
+        self.block_serial += 1
+        while f"Block {self.block_serial}" in self.blocks:
+            self.block_serial += 1
+        blk = Block(f"Block {self.block_serial}", items)
+        self.blocks[blk.name] = blk
+        return blk
+
     def paste_block(self):
+        """Insert a reference to a shared block built once from the clipboard, not copies of its items."""
         if not self.clipboard_data:
             return
         idx = self.get_selected_indices()
         ins = idx[-1] + 1 if idx else len(self.videos)
-        for j, v in enumerate(self.clipboard_data):
-            self.videos.insert(ins + j, v.copy())
+        if len(self.clipboard_data) == 1 and 'block' in self.clipboard_data[0]:
+            blk = self.clipboard_data[0]['block']
+        else:
+            if self.clipboard_block is None:
+                self.clipboard_block = self.new_block(self.clipboard_data)
+            blk = self.clipboard_block
+        self.apply_edit([("splice", ins, 0, [{"block": blk, "absolute_time": None}])], f"Paste {blk.name}")
+        self.update_timeline()
+        self.status_var.set(f"Pasted {blk.name} ({len(blk.items)} item(s)) at position {ins + 1}")
+
+    def expand_block(self):
+        """Copy on write: replace selected block rows with private, editable copies of their items."""
+        idx = [i for i in self.get_selected_indices() if 'block' in self.videos[i]]
+        if not idx:
+            messagebox.showinfo("Expand Block", "Select one or more block rows first.")
+            return
+        ops = []
+        for i in reversed(idx):
+            row = self.videos[i]
+            items = [dict(m) for m in row['block'].items]
+            if row.get('absolute_time') is not None:
+                # Keep the block's slot (and repeat rule) by chaining exact times
+                start = row['absolute_time']
+                for m in items:
+                    m['absolute_time'] = start
+                    if row.get('repeat'):
+                        m['repeat'] = list(row['repeat'])
+                    start += scheduled_duration(m)
+            ops.append(("splice", i, 1, items))
+        self.apply_edit(ops, "Expand block")
         self.update_timeline()
-        self.status_var.set(f"Pasted {len(self.clipboard_data)} item(s) at position {ins + 1}")
+        self.status_var.set(f"Expanded {len(idx)} block(s) into editable items")
+
+    def replace_block_contents(self):
+        """Edit the template: every row referencing the selected block picks up the clipboard items."""
+        idx = [i for i in self.get_selected_indices() if 'block' in self.videos[i]]
+        if not idx or not self.clipboard_data:
+            messagebox.showinfo("Replace Block", "Copy the new items, then select a block row.")
+            return
+        blocks = {id(self.videos[i]['block']): self.videos[i]['block'] for i in idx}
+        self.apply_edit([("items", blk, self.clipboard_data) for blk in blocks.values()], "Replace block contents")
+        self.update_timeline()
+        self.status_var.set(f"Updated {len(blocks)} block(s); every occurrence now uses the new items")
+
+    def repeat_selected(self):
+        sel = self.get_selected_indices()
+        if not sel:
+            messagebox.showwarning("Repeat", "Select one or more rows first.")
+            return
+        t = simpledialog.askstring("Repeat", "Rule, e.g. '06:00:00 daily' or '06:00:00 every 02:00:00 x6'", initialvalue="06:00:00 daily")
+        if not t:
+            return
+        try:
+            start, every, count = parse_recurrence(t)
+        except Exception:
+            messagebox.showerror("Invalid", "Use 'HH:MM:SS daily' or 'HH:MM:SS every HH:MM:SS xN'.")
+            return
+        # Chain multiple selected rows sequentially, each repeating on the same rule
+        ops = []
+        for i in sorted(sel):
+            v = self.videos[i]
+            ops += [("set", i, 'absolute_time', start), ("set", i, 'repeat', [every, count])]
+            start += scheduled_duration(v)
+        self.apply_edit(ops, "Repeat")
+        self.update_timeline()
+        self.status_var.set(f"Repeat '{t}' set for {len(sel)} row(s)")
+
+    # ---------- Persistence ----------
+    def row_to_json(self, v, defs=None):
+        if 'block' not in v:
+            return dict(v)
+        blk = v['block']
+        if defs is not None and blk.name not in self.journaled_blocks:
+            self.journaled_blocks.add(blk.name)
+            defs.append({"name": blk.name, "items": [dict(m) for m in blk.items]})
+        d = dict(v)
+        d['block'] = blk.name
+        return d
+
+    def row_from_json(self, d):
+        if 'block' in d:
+            d['block'] = self.blocks[d['block']]
+        return d
+
+    def journal_record(self, record):
+        if self.restoring:
+            return
+        self.journal.append(record)
+        if self.journal.due():
+            self.compact_state()
+
+    def journal_ops(self, ops):
+        """One fsynced record per edit group, carrying any new block definitions it references."""
+        if self.restoring:
+            return
+        defs = []
+        rec = {"t": "group", "ops": [self.op_to_json(op, defs) for op in ops]}
+        if defs:
+            rec["blocks"] = defs
+        self.journal_record(rec)
+
+    def op_to_json(self, op, defs):
+        kind = op[0]
+        if kind == "splice":
+            return {"t": "splice", "i": op[1], "n": op[2], "rows": [self.row_to_json(v, defs) for v in op[3]]}
+        if kind == "swap":
+            return {"t": "swap", "i": op[1], "j": op[2]}
+        if kind == "set":
+            rec = {"t": "set", "i": op[1], "k": op[2]}
+            if op[3] is UNSET:
+                rec["unset"] = True
+            else:
+                rec["v"] = op[3]
+            return rec
+        blk = op[1]
+        self.journaled_blocks.add(blk.name)
+        return {"t": "block", "name": blk.name, "items": [dict(m) for m in blk.items]}
+
+    def journal_fillers(self):
+        self.journal_record({"t": "fillers", "fillers": list(self.fillers), "durations": dict(self.filler_durations)})
+
+    def journal_settings(self, *args):
+        st = self.settings_state()
+        if st != self.journaled_settings:
+            self.journaled_settings = st
+            self.journal_record({"t": "settings", **st})
+
+    def journal_playout(self):
+        self.journal_record({"t": "playout", "broadcasting": self.broadcasting})
+
+    def settings_state(self):
+        return {
+            "host": self.obs_host_var.get(),
+            "port": self.obs_port_var.get(),
+            "start_time": self.start_time_var.get(),
+            "api_enabled": self.api_enabled_var.get()
+        }
+
+    def compact_state(self):
+        # Blocks no row references any more are dropped; one brought back later is journaled again
+        self.blocks = {v['block'].name: v['block'] for v in self.videos if 'block' in v}
+        self.journaled_blocks = set(self.blocks)
+        self.journal.compact({
+            "videos": [self.row_to_json(v) for v in self.videos],
+            "blocks": {name: [dict(m) for m in blk.items] for name, blk in self.blocks.items()},
+            "fillers": list(self.fillers),
+            "filler_durations": dict(self.filler_durations),
+            "settings": self.settings_state(),
+            "broadcasting": self.broadcasting
+        })
+
+    def replay_record(self, rec):
+        t = rec["t"]
+        if t == "group":
+            for d in rec.get("blocks", ()):
+                self.replay_record({"t": "block", **d})
+            for op in rec["ops"]:
+                self.replay_record(op)
+        elif t == "splice":
+            apply_edit_op(self.videos, ("splice", rec["i"], rec["n"], [self.row_from_json(d) for d in rec["rows"]]))
+        elif t == "swap":
+            apply_edit_op(self.videos, ("swap", rec["i"], rec["j"]))
+        elif t == "set":
+            apply_edit_op(self.videos, ("set", rec["i"], rec["k"], UNSET if rec.get("unset") else rec.get("v")))
+        elif t == "block":
+            if rec["name"] in self.blocks:
+                self.blocks[rec["name"]].set_items(rec["items"])
+            else:
+                self.blocks[rec["name"]] = Block(rec["name"], rec["items"])
+        elif t == "fillers":
+            self.fillers = rec["fillers"]
+            self.filler_durations = rec["durations"]
+        elif t == "settings":
+            self.apply_settings(rec)
+        elif t == "playout":
+            self.resume_on_launch = rec["broadcasting"]
+
+    def apply_settings(self, st):
+        self.obs_host_var.set(st.get("host", "127.0.0.1"))
+        self.obs_port_var.set(st.get("port", "4455"))
+        self.start_time_var.set(st.get("start_time", "00:00:00"))
+        self.api_enabled_var.set(bool(st.get("api_enabled", False)))
+
+    def restore_state(self):
+        """Rebuild the playlist, fillers and OBS settings from the snapshot and journal, without probing media."""
+        snap, records = self.journal.load()
+        if not snap and not records:
+            return
+        self.restoring = True
+        try:
+            if snap:
+                self.blocks = {name: Block(name, items) for name, items in snap.get("blocks", {}).items()}
+                self.videos = [self.row_from_json(d) for d in snap.get("videos", [])]
+                self.fillers = snap.get("fillers", [])
+                self.filler_durations = snap.get("filler_durations", {})
+                self.apply_settings(snap.get("settings", {}))
+                self.resume_on_launch = snap.get("broadcasting", False)
+            failed = None
+            for rec in records:
+                try:
+                    self.replay_record(rec)
+                except Exception as e:
+                    failed = f"record {rec.get('seq')}: {e}"
+                    print(f"Journal replay stopped at {failed}")
+                    break
+        finally:
+            self.restoring = False
+        self.journaled_settings = self.settings_state()
+        if failed:
+            # Keep the full journal before compaction truncates it
+            backup = self.journal.preserve()
+            messagebox.showwarning(
+                "Restore Incomplete",
+                f"The last session could only be restored up to {failed}\n\n"
+                f"Later changes were not applied. The original journal was kept at:\n{backup}"
+            )
+        self.compact_state()
+        self.update_timeline()
+        self.status_var.set(f"Restored {len(self.videos)} item(s) and {len(self.fillers)} filler(s) from last session")
+        if self.resume_on_launch:
+            self.root.after(0, self.resume_broadcast)
+
+    def on_close(self):
+        # A deliberate exit should not auto-resume playout on the next launch
+        self.broadcasting = False
+        if self.replay_clock:
+            self.replay_clock.stop()
+        self.compact_state()
+        if self.api:
+            self.api.close()
+        self.root.destroy()
+
+    def resume_broadcast(self):
+        """Reconnect and rejoin the schedule where it should be after a crash."""
+        err = self.connect_obs(quiet=True)
+        # The password is never written to disk; only ask when OBS answered but refused us
+        if err is not None and (not isinstance(err, OSError) or "auth" in str(err).lower()):
+            pw = simpledialog.askstring("Resume Broadcast", "OBS WebSocket password:", show="*")
+            if pw is None:
+                return
+            self.obs_password_var.set(pw)
+            self.connect_obs()
+        elif err is not None:
+            messagebox.showerror("Resume Failed", f"Could not reconnect to OBS:\n\n{err}")
+        if self.obs_client and self.videos:
+            self.start_broadcast()
+
+    # ---------- Schedule replay ----------
+    def replay_schedule(self):
+        """Ask for a span and speed, then replay the schedule in the background."""
+        if not self.videos:
+            messagebox.showinfo("Replay", "No videos to replay.")
+            return
+        if self.replay_clock:
+            messagebox.showinfo("Replay", "A replay is already running.")
+            return
+        days = simpledialog.askinteger("Replay Schedule", "Days to replay from today's midnight:", initialvalue=1, minvalue=1, maxvalue=31)
+        if not days:
+            return
+        speed = simpledialog.askinteger("Replay Schedule", "Speed (× real time, 0 = as fast as possible):", initialvalue=600, minvalue=0)
+        if speed is None:
+            return
+        self.recompute_schedule_times()
+        start = self.clock.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        # Snapshot everything on the Tk thread; the replay thread never reads live state
+        sim = self.prepare_replay(start, start + timedelta(days=days), speed)
+        threading.Thread(target=self.run_replay, args=(sim,), daemon=True).start()
+        self.status_var.set(f"Replaying {days} day(s) at {speed or 'max'}× ...")
+
+    def run_replay(self, sim):
+        try:
+            result = self.finish_replay(sim)
+            self.post_ui(self.show_replay, result)
+        except Exception as e:
+            print(f"Replay error: {e}")
+            self.post_ui(self.status_var.set, f"Replay failed: {e}", key="status")
+
+    def replay(self, start, end, speed=0):
+        """Play start..end on a simulated clock against a RecordingOBS and return the timeline; Tk thread only."""
+        return self.finish_replay(self.prepare_replay(start, end, speed))
+
+    def prepare_replay(self, start, end, speed):
+        """Tk side of a replay: copy the compiled schedule, durations and filler state, and claim the replay slot."""
+        norm = lambda p: os.path.abspath(p).replace('\\', '/')
+        durations = {}
+        for v in self.videos:
+            for m in (v['block'].items if 'block' in v else (v,)):
+                durations[norm(m['filepath'])] = float(m['duration'])
+        for p, d in self.filler_durations.items():
+            durations[norm(p)] = float(d)
+        sim = copy.copy(self)
+        clock = SimulatedClock(start, end, speed, on_end=lambda: setattr(sim, "broadcasting", False))
+        sim.clock = clock
+        sim.obs_client = RecordingOBS(clock, durations)
+        sim.broadcasting = True
+        sim.fillers_active = False
+        sim.current_slot = None
+        sim.current_video_index = -1
+        sim.playout_commands = queue.Queue()
+        sim.filler_plan = None
+        sim.fillers_fingerprint = None
+        sim.filler_last_played = dict(self.filler_last_played)
+        sim.filler_durations = dict(self.filler_durations)
+        sim.fillers = list(self.fillers)
+        sim.api = None
+        sim.post_ui = lambda *args, **kwargs: None
+        self.replay_clock = clock
+        return sim
+
+    def finish_replay(self, sim):
+        clock = sim.clock
+        start, end, speed = clock.start, clock.end, clock.speed
+        began = time.monotonic()
+        try:
+            sim.broadcast_controller()
+        finally:
+            self.replay_clock = None
+        kinds = {self.PLAYER_INPUT: "media", self.FILLERS_INPUT: "fillers", None: "dead_air"}
+        timeline = [
+            {"start": s.isoformat(), "end": e.isoformat(), "seconds": (e - s).total_seconds(), "kind": kinds.get(name, name), "file": f}
+            for s, e, name, f in sim.obs_client.timeline(start, end)
+        ]
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "speed": speed,
+            "wall_seconds": round(time.monotonic() - began, 3),
+            "switches": len(sim.obs_client.airings),
+            "requests": sim.obs_client.requests,
+            "dead_air_seconds": sum(t["seconds"] for t in timeline if t["kind"] == "dead_air"),
+            "timeline": timeline
+        }
+
+    def show_replay(self, result):
+        dead = [t for t in result["timeline"] if t["kind"] == "dead_air"]
+        summary = (f"{result['start'][:10]} → {result['end'][:10]}: {result['switches']} switch(es), "
+                   f"{len(dead)} gap(s), {self.format_duration(int(result['dead_air_seconds']))} dead air "
+                   f"(replayed in {result['wall_seconds']:.1f}s)")
+        self.status_var.set(f"Replay done: {summary}")
+        win = tk.Toplevel(self.root)
+        win.title("Schedule Replay")
+        win.configure(bg=self.bg)
+        win.columnconfigure(0, weight=1)
+        win.rowconfigure(1, weight=1)
+        ttk.Label(win, text=summary).grid(row=0, column=0, columnspan=2, sticky="w", padx=6, pady=4)
+        text = tk.Text(win, width=100, height=30, bg=self.acc, fg=self.fg, insertbackground=self.fg)
+        text.grid(row=1, column=0, sticky="nsew")
+        sb = ttk.Scrollbar(win, orient=tk.VERTICAL, command=text.yview)
+        sb.grid(row=1, column=1, sticky="ns")
+        text.configure(yscrollcommand=sb.set)
+        marks = {"media": "▶", "fillers": "⏸", "dead_air": "⚠"}
+        for t in result["timeline"]:
+            what = os.path.basename(t["file"]) if t["file"] else "DEAD AIR"
+            line = f"{t['start'].replace('T', ' ')}  {self.format_duration(int(t['seconds'])):>8}  {marks.get(t['kind'], '?')} {what}\n"
+            text.insert(tk.END, line)
+        text.configure(state='disabled')
+        ttk.Button(win, text="💾 Save Timeline", command=lambda: self.save_replay(result)).grid(row=2, column=0, columnspan=2, pady=4)
+
+    def save_replay(self, result):
+        p = filedialog.asksaveasfilename(title="Save replay timeline", defaultextension=".json", filetypes=[("Timeline", "*.json"), ("All", "*.*")])
+        if not p:
+            return
+        try:
+            with open(p, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+            self.status_var.set(f"Replay timeline saved to {p}")
+        except Exception as e:
+            messagebox.showerror("Replay", f"Could not save timeline:\n{e}")
+
+    # ---------- Control API ----------
+    def start_api(self):
+        if self.api or not self.api_enabled_var.get():
+            return
+        try:
+            self.api = ControlAPI(self, api_token())
+            self.publish_schedule()
+            self.publish_status()
+            print(f"Control API listening on {self.api.address}")
+        except OSError as e:
+            print(f"Control API disabled: {e}")
+            self.api_enabled_var.set(False)
+            self.status_var.set(f"Control API could not start: {e}")
+
+    def toggle_api(self):
+        if self.api_enabled_var.get():
+            self.start_api()
+            if self.api:
+                self.status_var.set(f"Control API on at {self.api.address}")
+        elif self.api:
+            self.api.close()
+            self.api = None
+            self.status_var.set("Control API off")
+        self.journal_settings()
+
+    def copy_api_token(self):
+        self.root.clipboard_clear()
+        self.root.clipboard_append(api_token())
+        self.status_var.set("API token copied to clipboard")
+
+    def pump_ui_queue(self):
+        """Run callables handed over from other threads; only the Tk thread touches widgets and the playlist."""
+        try:
+            while True:
+                fn = self.ui_queue.get_nowait()
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"UI task error: {e}")
+        except queue.Empty:
+            pass
+        with self.ui_lock:
+            updates, self.ui_updates = self.ui_updates, {}
+        for fn, args in updates.values():
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"UI update error: {e}")
+        self.root.after(20, self.pump_ui_queue)
+
+    def post_ui(self, fn, *args, key=None):
+        """Queue a widget update from any thread without waiting; a newer update with the same key replaces an older one."""
+        with self.ui_lock:
+            if key is None:
+                self.ui_seq += 1
+                key = self.ui_seq
+            self.ui_updates.pop(key, None)
+            self.ui_updates[key] = (fn, args)
+
+    def call_on_ui(self, fn, *args, timeout=5):
+        """Run fn on the Tk thread and return its result to the calling thread."""
+        if threading.current_thread() is threading.main_thread():
+            return fn(*args)
+        done = threading.Event()
+        lock = threading.Lock()
+        box = {}
+        def task():
+            with lock:
+                if box.get("cancelled"):
+                    return
+                box["started"] = True
+            try:
+                box["result"] = fn(*args)
+            except Exception as e:
+                box["error"] = e
+            finally:
+                done.set()
+        self.ui_queue.put(task)
+        if not done.wait(timeout):
+            with lock:
+                if not box.get("started"):
+                    # Never run a command the caller was told failed
+                    box["cancelled"] = True
+                    raise TimeoutError("GUI did not answer in time")
+            done.wait()
+        if "error" in box:
+            raise box["error"]
+        return box.get("result")
+
+    def publish_schedule(self):
+        if not self.api:
+            return
+        self.schedule_version += 1
+        rows = tuple(
+            (row_title(v), s, e, v.get('absolute_time') is not None, v.get('repeat'))
+            for v, s, e in zip(self.videos, self.abs_starts, self.abs_ends)
+        )
+        self.api.publish_schedule(self.schedule_version, rows)
+        self.publish_status()
+
+    def publish_status(self):
+        if not self.api:
+            return
+        now = self.clock.seconds_since_midnight()
+        occ = self.occurrence_for_time(now)
+        current = None
+        if occ:
+            i, s, e = occ
+            media, offset = self.compiled.media_at(i, now - s)
+            current = {"index": i, "title": row_title(self.videos[i]), "media": media[2], "start": s, "end": e}
+        nxt_idx, nxt_start = self.next_occurrence(now)
+        nxt = {"index": nxt_idx, "title": row_title(self.videos[nxt_idx]), "start": nxt_start} if nxt_idx is not None else None
+        self.api.publish_status({
+            "broadcasting": self.broadcasting,
+            "fillers_active": self.fillers_active,
+            "on_air_index": self.current_video_index,
+            "now": current,
+            "next": nxt,
+            "schedule_version": self.schedule_version
+        })
+
+    # API commands must never open a dialog: the HTTP thread would sit waiting on it
+    def api_skip(self, args):
+        if not self.broadcasting:
+            raise CommandConflict("not broadcasting")
+        self.skip_to_next()
+        return {"queued": True}
+
+    def api_jump(self, args):
+        index = int(args["index"])
+        if not (0 <= index < len(self.videos)):
+            raise ValueError(f"index {index} out of range")
+        if not self.obs_client:
+            raise CommandConflict("not connected to OBS")
+        self.jump_to_index(index)
+        return {"queued": True}
+
+    def api_insert(self, args):
+        rows = args["items"]
+        if not rows:
+            raise ValueError("no items to insert")
+        index = int(args.get("index", len(self.videos)))
+        index = max(0, min(index, len(self.videos)))
+        self.apply_edit([("splice", index, 0, rows)], f"Insert {len(rows)} item(s) via API")
+        self.update_timeline()
+        return {"inserted": len(rows), "index": index}
+
+    def api_delete(self, args):
+        indices = [int(i) for i in args["indices"]]
+        return {"deleted": self.delete_indices(indices)}
+
+    def api_set_start(self, args):
+        indices = [int(i) for i in args["indices"]]
+        t = args.get("time")
+        if t is None:
+            self.clear_start_for_indices(indices)
+        else:
+            if isinstance(t, bool) or not isinstance(t, (str, int)):
+                raise ValueError("time must be HH:MM:SS or seconds since midnight")
+            s = parse_hms(t) if isinstance(t, str) else t
+            if not 0 <= s < 86400:
+                raise ValueError("time must be HH:MM:SS within the day")
+            self.set_start_for_indices(indices, s)
+        return {"updated": len(indices)}
 
     # ---------- Export ----------
     def export_playlist(self):
@@ -845,18 +2645,26 @@ class PlaylistScheduler:
         self.recompute_schedule_times()
         sched = {"videos": [], "start_time": self.start_time_var.get(), "total_duration": self.total_duration, "fillers": [os.path.abspath(f) for f in self.fillers]}
         for i, v in enumerate(self.videos):
-            sched["videos"].append({
+            entry = {
                 "index": i,
-                "filename": v["filename"],
-                "filepath": os.path.abspath(v["filepath"]),
-                "duration": float(v["duration"]),
+                "filename": row_title(v),
+                "filepath": None if 'block' in v else os.path.abspath(v["filepath"]),
+                "duration": float(v['block'].duration if 'block' in v else v["duration"]),
                 "absolute_time": v.get("absolute_time"),
+                "trim_to": v.get("trim_to"),
+                "repeat": v.get("repeat"),
                 "start_time_abs": int(self.abs_starts[i]),
                 "start_formatted": self.format_duration(self.abs_starts[i]),
                 "end_formatted": self.format_duration(self.abs_ends[i]),
                 "scene_name": self.PLAYER_SCENE,
                 "is_exact_time": v.get("absolute_time") is not None
-            })
+            }
+            if 'block' in v:
+                entry["block"] = {
+                    "name": v['block'].name,
+                    "items": [{"filename": m["filename"], "filepath": os.path.abspath(m["filepath"]), "duration": float(m["duration"])} for m in v['block'].items]
+                }
+            sched["videos"].append(entry)
         try:
             with open(p, "w", encoding="utf-8") as f:
                 json.dump(sched, f, indent=2)
@@ -873,6 +2681,7 @@ def main():
     else:
         root = tk.Tk()
     app = PlaylistScheduler(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.update_idletasks()
     x = (root.winfo_screenwidth() // 2) - (root.winfo_width() // 2)
     y = (root.winfo_screenheight() // 2) - (root.winfo_height() // 2)
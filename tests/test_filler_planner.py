@@ -0,0 +1,38 @@
+import random
+import time
+
+import pytest
+
+pytest.importorskip("tkinter")
+pytest.importorskip("obsws_python")
+
+from scheduler_app import plan_filler_sequence
+
+
+def probed_durations(n, seed):
+    rng = random.Random(seed)
+    return {f"ad{i}.mp4": rng.uniform(15, 60) for i in range(n)}
+
+
+@pytest.mark.parametrize("n", [3, 20, 40, 200])
+def test_long_gap_is_planned_quickly_and_tightly(n):
+    durations = probed_durations(n, seed=n)
+    started = time.perf_counter()
+    seq, total = plan_filler_sequence(3 * 3600, durations)
+    elapsed = time.perf_counter() - started
+    real = sum(durations[p] for p in seq)
+    assert elapsed < 0.2
+    assert real <= 3 * 3600
+    assert abs(real - total) <= 0.001 * len(seq)
+    assert 3 * 3600 - real < (60 if n <= 4 else 5)
+
+
+def test_fractional_durations_do_not_drift():
+    seq, total = plan_filler_sequence(6 * 3600, {"a": 30, "b": 45, "c": 20.5})
+    assert 6 * 3600 - 1 <= total <= 6 * 3600
+
+
+def test_small_set_repeats_in_tail():
+    seq, total = plan_filler_sequence(95, {"a": 30, "b": 45, "c": 21})
+    assert total == 93
+    assert sorted(seq) == ["a", "c", "c", "c"]